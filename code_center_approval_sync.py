@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from blackduck.HubRestApi import HubInstance
+
+from code_center_component_import import CodeCenterComponentImport, ApprovalStatusConflict
+from code_center_export_reader import CodeCenterExportReader
+from hub_transport import HubTransport
+
+
+class PsqlQueryRunner(object):
+	'''Runs queries against the Code Center (catalog) database using psql, the same way the export scripts
+	in bin/ do, and returns the rows as dicts. Connection details not given here come from the usual
+	PG* environment variables (e.g. PGPASSWORD)
+	'''
+	def __init__(self, database='bds_catalog', host=None, port=None, user=None, psql='psql'):
+		self.connection_args = ['-d', database]
+		if host:
+			self.connection_args.extend(['-h', host])
+		if port:
+			self.connection_args.extend(['-p', str(port)])
+		if user:
+			self.connection_args.extend(['-U', user])
+		self.psql = psql
+
+	def __call__(self, sql):
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			output_file = os.path.join(tmp_dir, 'output.csv')
+			subprocess.run(
+				[self.psql, '-qA', '-F', '|', '-P', 'footer=off', '-v', 'ON_ERROR_STOP=1'] + self.connection_args +
+				['-o', output_file, '-c', sql],
+				check=True, stdin=subprocess.DEVNULL)
+			if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+				return []
+			return list(CodeCenterExportReader(output_file, workers=1))
+
+
+class CodeCenterApprovalSync(object):
+	'''Keeps the Hub component approval statuses in sync with Code Center by polling the Code Center database for
+	componentuse rows submitted since the last poll (the watermark) and for components whose componentuse approval
+	statuses changed (e.g. a pending request that was approved), and re-importing the approvals for just those
+	component:version keys.
+
+	Rows can commit after rows with a later time_submitted, so each poll looks back watermark_overlap seconds
+	past the watermark and skips the rows it already saw there.
+
+	Each poll (and so each psql process and temporary file) queries the production Code Center database. The
+	watermark query only returns recently submitted rows, but finding the changed approval statuses takes a
+	group-by (string_agg/md5) over the whole componentuse table, so that scan runs at most every digest_interval
+	seconds rather than on every poll.
+
+	A component that fails to sync is retried after retry_delay seconds, doubling the delay after each failure, up to
+	max_attempts times. Some failures are permanent (e.g. a Protex component without a match in the Hub KB), after the
+	last attempt the component is only synced again when it changes in Code Center.
+
+	The watermark, the rows seen in the overlap, a digest of each component's componentuse approval statuses, and
+	the components that failed to sync are persisted in state_file whenever they change so the sync picks up where
+	it left off after a restart. Without any state the first poll imports every component.
+	'''
+	# Same columns as bin/cc-export-project-component-approvals.sh so the rows look like the export rows
+	COMPONENT_APPROVALS_SQL = '''select
+cu.approval_status,
+c.name as component_name,
+c.version as component_version,
+cu.kb_license_name,
+a.name as project_name,
+a.version as project_version,
+u.name as user_name,
+u.first_name,
+u.last_name,
+cu.time_submitted,
+c.kb_component_id,
+c.kb_release_id,
+c.id as catalogid,
+a.id as projectid
+from componentuse cu join component c on c.id=cu.component
+join application a on a.id =cu.application join enduser u on u.id=cu.owner
+where c.kb_component_id is not null{}'''
+
+	SUBMITTED_SINCE_SQL = '''select c.id as catalogid, cu.application as projectid, to_char(cu.time_submitted, 'YYYY-MM-DD HH24:MI:SS.US') as time_submitted
+from componentuse cu join component c on c.id=cu.component
+where c.kb_component_id is not null and cu.time_submitted is not null{}'''
+
+	# The componentuse approval statuses are what gets imported, the digest changes whenever one of them does
+	COMPONENT_USE_APPROVAL_STATUSES_SQL = '''select c.id as catalogid,
+md5(string_agg(coalesce(cu.approval_status, ''), ',' order by cu.approval_status)) as approval_statuses
+from componentuse cu join component c on c.id=cu.component
+where c.kb_component_id is not null group by c.id'''
+
+	WATERMARK_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+	def __init__(
+			self, run_query, hub_instance, state_file, watermark_overlap=300, retry_delay=60, max_attempts=5, digest_interval=60):
+		self.run_query = run_query
+		self.hub_instance = hub_instance
+		self.state_file = state_file
+		self.watermark_overlap = watermark_overlap
+		self.retry_delay = retry_delay
+		self.max_attempts = max_attempts
+		self.digest_interval = digest_interval
+		self._digests_scanned_at = None
+		self.state = {
+			'watermark': None,
+			'recently_submitted': [],
+			'component_use_approval_statuses': {},
+			# catalog id -> number of failed attempts and when to retry
+			'failed_catalog_ids': {},
+		}
+
+	def load(self):
+		if os.path.exists(self.state_file):
+			with open(self.state_file) as f:
+				self.state = json.load(f)
+			logging.debug("Loaded sync state from {}, watermark {}".format(self.state_file, self.state['watermark']))
+		return self
+
+	def save(self):
+		# write then rename so an interrupted sync never leaves a partial state file behind
+		tmp_file = self.state_file + ".tmp"
+		with open(tmp_file, 'w') as f:
+			json.dump(self.state, f)
+		os.replace(tmp_file, self.state_file)
+
+	def _changed_catalog_ids(self):
+		'''Returns the (catalog) ids of the components with new componentuse rows or changed componentuse approval
+		statuses, or None if every component should be synced, along with the state to keep for the next poll
+		'''
+		watermark = self.state['watermark']
+		if watermark:
+			since = " and cu.time_submitted > timestamp '{}' - interval '{} seconds'".format(
+				watermark.replace("'", "''"), int(self.watermark_overlap))
+		else:
+			since = ""
+		now = time.time()
+		changed = set(
+			catalog_id for catalog_id, failure in self.state['failed_catalog_ids'].items() if failure['retry_at'] <= now)
+		previously_submitted = set(self.state['recently_submitted'])
+		submitted = []
+		new_watermark = watermark
+		for row in self.run_query(CodeCenterApprovalSync.SUBMITTED_SINCE_SQL.format(since)):
+			submission = "{}|{}|{}".format(row['catalogid'], row['projectid'], row['time_submitted'])
+			if submission not in previously_submitted:
+				changed.add(row['catalogid'])
+			submitted.append((row['time_submitted'], submission))
+			if new_watermark is None or row['time_submitted'] > new_watermark:
+				new_watermark = row['time_submitted']
+		# Only the rows the next poll will look at again need to be remembered
+		if new_watermark:
+			overlap_start = (datetime.strptime(new_watermark, CodeCenterApprovalSync.WATERMARK_FORMAT) -
+				timedelta(seconds=self.watermark_overlap)).strftime(CodeCenterApprovalSync.WATERMARK_FORMAT)
+			recently_submitted = sorted(submission for time_submitted, submission in submitted if time_submitted > overlap_start)
+		else:
+			recently_submitted = []
+
+		previous_statuses = self.state['component_use_approval_statuses']
+		if self._digests_scanned_at is None or now - self._digests_scanned_at >= self.digest_interval:
+			component_use_approval_statuses = {}
+			for row in self.run_query(CodeCenterApprovalSync.COMPONENT_USE_APPROVAL_STATUSES_SQL):
+				component_use_approval_statuses[row['catalogid']] = row['approval_statuses']
+				if previous_statuses and previous_statuses.get(row['catalogid']) != row['approval_statuses']:
+					changed.add(row['catalogid'])
+			self._digests_scanned_at = now
+		else:
+			component_use_approval_statuses = previous_statuses
+		if watermark is None and not previous_statuses:
+			changed = None
+		return (changed, {
+			'watermark': new_watermark,
+			'recently_submitted': recently_submitted,
+			'component_use_approval_statuses': component_use_approval_statuses,
+		})
+
+	def poll(self):
+		'''Sync the components that changed since the last poll. Returns a dict of result ('Updated', 'Equal', 'Failed',
+		or 'Conflict') -> number of component:version keys
+		'''
+		changed, new_state = self._changed_catalog_ids()
+		results = {}
+		failed_catalog_ids = set()
+		if changed is None or changed:
+			if changed is None:
+				only_changed = ""
+			else:
+				only_changed = " and c.id in ({})".format(",".join(str(int(catalog_id)) for catalog_id in sorted(changed)))
+			rows = self.run_query(CodeCenterApprovalSync.COMPONENT_APPROVALS_SQL.format(only_changed))
+			component_approvals_by_key = {}
+			for row in rows:
+				key = "{}:{}".format(row['component_name'], row['component_version'])
+				component_approvals_by_key.setdefault(key, []).append(row)
+
+			# A new importer for each poll so no Hub lookups are re-used from an earlier poll
+			importer = CodeCenterComponentImport(None, self.hub_instance)
+			for component_name_and_version, component_approvals in component_approvals_by_key.items():
+				try:
+					suite_component_info = importer._reconcile_component_approvals(
+						component_name_and_version, component_approvals)
+				except ApprovalStatusConflict:
+					logging.warning(
+						"The component {} could not be synced due to an approval status conflict among the CC component approval requests ({})".format(
+							component_name_and_version, component_approvals))
+					result = 'Conflict'
+				else:
+					result = importer._import_component(suite_component_info)
+				results[result] = results.get(result, 0) + 1
+				if result == 'Failed':
+					failed_catalog_ids.update(row['catalogid'] for row in component_approvals)
+			logging.info("Synced {} components: {}".format(len(component_approvals_by_key), results))
+
+		new_state['failed_catalog_ids'] = self._failures(changed, failed_catalog_ids)
+		if new_state != self.state:
+			self.state = new_state
+			self.save()
+		return results
+
+	def _failures(self, synced_catalog_ids, failed_catalog_ids):
+		# The earlier failures that were not retried in this poll are kept as they are
+		previous_failures = self.state['failed_catalog_ids']
+		if synced_catalog_ids is None:
+			failures = {}
+		else:
+			failures = {
+				catalog_id: failure for catalog_id, failure in previous_failures.items() if catalog_id not in synced_catalog_ids}
+		now = time.time()
+		for catalog_id in failed_catalog_ids:
+			attempts = previous_failures.get(catalog_id, {}).get('attempts', 0) + 1
+			if attempts >= self.max_attempts:
+				logging.warning("Giving up on syncing Code Center component {} after {} attempts, it will be synced again when it changes in Code Center".format(
+					catalog_id, attempts))
+				continue
+			failures[catalog_id] = {'attempts': attempts, 'retry_at': now + self.retry_delay * 2 ** (attempts - 1)}
+		return failures
+
+	def run(self, poll_interval=5, max_polls=None):
+		polls = 0
+		while max_polls is None or polls < max_polls:
+			start = time.time()
+			try:
+				self.poll()
+			except:
+				logging.error("Failed to sync component approvals, will retry", exc_info=True)
+			polls += 1
+			if max_polls is None or polls < max_polls:
+				time.sleep(max(0, poll_interval - (time.time() - start)))
+
+
+if __name__ == "__main__":
+	import argparse
+	import sys
+
+	parser = argparse.ArgumentParser("Continuously sync component approval status changes in Code Center into Black Duck (Hub)")
+	parser.add_argument("state_file", help="File in which the sync watermark and componentuse approval statuses are kept between polls (and restarts)")
+	parser.add_argument("-d", "--database", default="bds_catalog", help="The Code Center database (default: bds_catalog)")
+	parser.add_argument("--host", help="The Code Center database host (default: psql's default)")
+	parser.add_argument("--port", help="The Code Center database port (default: psql's default)")
+	parser.add_argument("-U", "--user", help="The Code Center database user (default: psql's default)")
+	parser.add_argument("-i", "--poll_interval", type=float, default=5, help="Seconds between polls of the Code Center database for newly submitted componentuse rows. Each poll runs psql against the (production) Code Center database (default: 5)")
+	parser.add_argument("-g", "--digest_interval", type=float, default=60, help="Seconds between scans for changed componentuse approval statuses (e.g. a pending request that was approved). Each scan is a group-by over the whole componentuse table (default: 60)")
+	parser.add_argument("-o", "--watermark_overlap", type=int, default=300, help="Seconds before the watermark to look back for componentuse rows that were committed late (default: 300)")
+	parser.add_argument("-r", "--retry_delay", type=float, default=60, help="Seconds before a component that failed to sync is retried, doubled after each failure (default: 60)")
+	parser.add_argument("-m", "--max_attempts", type=int, default=5, help="Number of times to try syncing a component before giving up on it until it changes in Code Center (default: 5)")
+	parser.add_argument("-c", "--connection_pool_size", type=int, default=1, help="Number of (keep-alive) connections to the Hub to keep in the pool, one per thread making Hub calls (default: 1)")
+	parser.add_argument("-t", "--timeout", type=float, default=60, help="Timeout, in seconds, for each request to the Hub (default: 60)")
+	parser.add_argument("-l", "--loglevel", choices=["CRITICAL", "DEBUG", "ERROR", "INFO", "WARNING"], default="INFO", help="Choose the desired logging level - CRITICAL, DEBUG, ERROR, INFO, or WARNING. (default: INFO)")
+	args = parser.parse_args()
+
+	logging_levels = {
+		'CRITICAL': logging.CRITICAL,
+		'DEBUG': logging.DEBUG,
+		'ERROR': logging.ERROR,
+		'INFO': logging.INFO,
+		'WARNING': logging.WARNING,
+	}
+	logging.basicConfig(stream=sys.stdout, format='%(threadName)s: %(asctime)s: %(levelname)s: %(message)s', level=logging_levels[args.loglevel])
+	logging.getLogger("requests").setLevel(logging.WARNING)
+	logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+	hub = HubInstance()
+	transport = HubTransport(pool_size=args.connection_pool_size, timeout=args.timeout)
+	transport.install(hub)
+
+	sync = CodeCenterApprovalSync(
+		PsqlQueryRunner(database=args.database, host=args.host, port=args.port, user=args.user), hub, args.state_file,
+		watermark_overlap=args.watermark_overlap, retry_delay=args.retry_delay, max_attempts=args.max_attempts,
+		digest_interval=args.digest_interval).load()
+	try:
+		sync.run(poll_interval=args.poll_interval)
+	except KeyboardInterrupt:
+		logging.info("Stopping the sync")
+	finally:
+		logging.info(transport.report())
+		transport.close()
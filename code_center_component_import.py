@@ -2,10 +2,15 @@
 
 import csv
 import logging
+import random
 from pprint import pprint
 
 from blackduck.HubRestApi import HubInstance
 
+from code_center_export_reader import CodeCenterExportReader, InvalidExportFile
+from hub_transport import HubTransport
+from phase_profiler import PhaseProfiler
+
 class ApprovalStatusConflict(Exception):
 	pass
 
@@ -31,9 +36,16 @@ class CodeCenterComponentImport(object):
 	COMPONENT_ID_COL_NAME='kb_component_id'
 	RELEASE_ID_COL_NAME='kb_release_id'
 
+	REQUIRED_COL_NAMES = [
+		COMPONENT_COL_NAME, VERSION_COL_NAME, APPROVAL_COL_NAME, COMPONENT_ID_COL_NAME, RELEASE_ID_COL_NAME]
+
 	SUPPORTED_COMPONENT_TYPES = ["STANDARD", "STANDARD_MODIFIED"]
 
-	def __init__(self, component_approval_status_export_file, hub_instance):
+	# Fields in a Hub component/version document that are not sent back when updating the approval status
+	APPROVAL_UPDATE_EXCLUDED_FIELDS = ['_meta']
+
+	def __init__(
+			self, component_approval_status_export_file, hub_instance, verify_sample_size=0, profiler=None, reader_workers=None):
 		'''Expects a pipe-delimited ("|") file with a header row that includes the following fields (note the case and spaces in the names)
 			- Component
 			- Version
@@ -44,6 +56,18 @@ class CodeCenterComponentImport(object):
 		'''
 		self.component_approval_status_export_file = component_approval_status_export_file
 		self.hub_instance = hub_instance
+		# Many Code Center rows share the same component (or component url) so the (successful) Hub lookups are kept
+		# for the run. The Hub component for a Protex component/release does not change during a run, a Hub
+		# component/version is dropped whenever it is updated
+		self.hub_component_info = {}
+		self.hub_components = {}
+		self.hub_lookups = 0
+		self.hub_lookups_reused = 0
+		# Updates are not re-read after they are made, optionally a sample of them is verified at the end of the run
+		self.verify_sample_size = verify_sample_size
+		self.updated_component_urls = []
+		self.profiler = profiler or PhaseProfiler()
+		self.reader_workers = reader_workers
 
 	def _update_approval_status(self, protex_component_id, protex_approval_status, protex_release_id=None):
 		'''Given a Protex component info (component id, release id, approval status) import the component
@@ -62,10 +86,7 @@ class CodeCenterComponentImport(object):
 		protex_release_id = None if protex_release_id == "null" else protex_release_id
 		logging.debug("Searching for Protex component with ID {} and version ID {}".format(protex_component_id, protex_release_id))
 		try:
-			hub_component_info = self.hub_instance.find_component_info_for_protex_component(
-					protex_component_id,
-					protex_release_id
-				)
+			hub_component_info = self._find_hub_component_info(protex_component_id, protex_release_id)
 			if hub_component_info:
 				logging.debug("Found Hub component info for protex component id {} and release id {}: {}".format(
 					protex_component_id, protex_release_id, hub_component_info))
@@ -77,33 +98,7 @@ class CodeCenterComponentImport(object):
 					logging.error("Hub component info ({}) did not contain either a component or version url".format(hub_component_info))
 					return False
 
-				component_or_version_details = self.hub_instance.get_component_by_url(details_url)
-
-				if component_or_version_details and 'approvalStatus' in component_or_version_details:
-					current_approval_status = component_or_version_details['approvalStatus']
-					new_approval_status = CodeCenterComponentImport.APPROVAL_STATUS_MAP[protex_approval_status]
-
-					if current_approval_status != new_approval_status:
-						component_or_version_details['approvalStatus'] = new_approval_status
-						logging.debug("Updating approval status (in Hub component/version) from {} to {}".format(
-							current_approval_status, new_approval_status))
-						response = self.hub_instance.update_component_by_url(details_url, component_or_version_details)
-						if response.status_code == 200:
-							result = "Updated"
-							logging.info("Updated approval status to {}".format(new_approval_status))
-						else:
-							result = "Failed"
-							logging.error("Failed to update approval status, status code: {}".format(response.status_code))
-					else:
-						result = "Equal"
-						logging.debug("Current approval status and new are equal for (protex) component {}, release/version {}".format(
-							protex_component_id, protex_release_id))
-					
-					component_or_version_details = self.hub_instance.get_component_by_url(details_url)
-					logging.debug("approvalStatus after update: {}".format(component_or_version_details['approvalStatus']))
-				else:
-					logging.error("Hmm, that's odd, the Hub component/version didn't have an 'approvalStatus' field ({})".format(
-						component_or_version_details))
+				result = self._set_approval_status(details_url, protex_component_id, protex_release_id, protex_approval_status)
 			else:
 				logging.warning('Could not locate Hub component or component version for Protex component id {} and release id {}'.format(protex_component_id, protex_release_id))
 		except:
@@ -114,6 +109,122 @@ class CodeCenterComponentImport(object):
 		finally:
 			return result
 
+	def _set_approval_status(
+			self, details_url, protex_component_id, protex_release_id, protex_approval_status, retry_on_conflict=True):
+		# Read the Hub component/version and update its approval status if it differs. An update rejected because the
+		# component/version changed since it was read (412) is retried, once, against a fresh read
+		result = 'Failed'
+		component_or_version_details, etag = self._get_component_by_url(details_url)
+
+		if component_or_version_details and 'approvalStatus' in component_or_version_details:
+			current_approval_status = component_or_version_details['approvalStatus']
+			new_approval_status = CodeCenterComponentImport.APPROVAL_STATUS_MAP[protex_approval_status]
+
+			if current_approval_status != new_approval_status:
+				logging.debug("Updating approval status (in Hub component/version) from {} to {}".format(
+					current_approval_status, new_approval_status))
+				response = self._update_component_approval_status(
+					details_url, component_or_version_details, new_approval_status, etag)
+				if response.status_code == 200:
+					result = "Updated"
+					self.updated_component_urls.append((details_url, new_approval_status))
+					logging.info("Updated approval status to {}".format(new_approval_status))
+				elif response.status_code == 412 and retry_on_conflict:
+					logging.warning("The Hub component/version {} changed since it was read, re-reading it and retrying the update".format(
+						details_url))
+					result = self._set_approval_status(
+						details_url, protex_component_id, protex_release_id, protex_approval_status, retry_on_conflict=False)
+				elif response.status_code == 412:
+					result = "Failed"
+					logging.error("Failed to update approval status, the Hub component/version {} changed since it was read".format(
+						details_url))
+				else:
+					result = "Failed"
+					logging.error("Failed to update approval status, status code: {}".format(response.status_code))
+			else:
+				result = "Equal"
+				logging.debug("Current approval status and new are equal for (protex) component {}, release/version {}".format(
+					protex_component_id, protex_release_id))
+		else:
+			logging.error("Hmm, that's odd, the Hub component/version didn't have an 'approvalStatus' field ({})".format(
+				component_or_version_details))
+		return result
+
+	def _find_hub_component_info(self, protex_component_id, protex_release_id):
+		key = (protex_component_id, protex_release_id)
+		if key in self.hub_component_info:
+			self.hub_lookups_reused += 1
+		else:
+			self.hub_component_info[key] = self._fetch_hub_component_info(protex_component_id, protex_release_id)
+		return self.hub_component_info[key]
+
+	def _fetch_hub_component_info(self, protex_component_id, protex_release_id):
+		# The same query HubInstance.find_component_info_for_protex_component makes, but that returns whatever the
+		# Hub sent back, including error responses, and those must not be kept
+		self.hub_lookups += 1
+		if protex_release_id:
+			query = "?q=bdsuite:{}%23{}&limit=9999".format(protex_component_id, protex_release_id)
+		else:
+			query = "?q=bdsuite:{}&limit=9999".format(protex_component_id)
+		response = self.hub_instance.execute_get(self.hub_instance.config['baseurl'] + "/api/components" + query)
+		response.raise_for_status()
+		return response.json()
+
+	def _get_component_by_url(self, component_url):
+		'''Returns a tuple of the Hub component/version details and its ETag (None if the Hub did not send one).
+		The details are read-only, they are shared with the other rows for the same component/version
+		'''
+		if component_url in self.hub_components:
+			self.hub_lookups_reused += 1
+		else:
+			self.hub_components[component_url] = self._fetch_component(component_url)
+		return self.hub_components[component_url]
+
+	def _fetch_component(self, component_url):
+		self.hub_lookups += 1
+		response = self.hub_instance.execute_get(component_url)
+		response.raise_for_status()
+		return (response.json(), response.headers.get('ETag'))
+
+	def _update_component_approval_status(self, component_url, component_or_version_details, new_approval_status, etag=None):
+		# The Hub replaces the component/version with what we PUT so the writable fields have to be sent back,
+		# but the (large) hypermedia links are not needed. If the Hub gave us an ETag the update is made
+		# conditional on the component/version not having changed since we read it, which also catches a kept
+		# component/version that went stale
+		update_json = {
+			k: v for k, v in component_or_version_details.items()
+			if k not in CodeCenterComponentImport.APPROVAL_UPDATE_EXCLUDED_FIELDS}
+		update_json['approvalStatus'] = new_approval_status
+		custom_headers = {'If-Match': etag} if etag else {}
+		# whether it was updated or changed by someone else (412), what was read is no longer current
+		self.hub_components.pop(component_url, None)
+		return self.hub_instance.execute_put(component_url, update_json, custom_headers=custom_headers)
+
+	def verify_updates(self):
+		'''Re-read a random sample (of size self.verify_sample_size) of the components/versions updated during
+		this run and check their approval status. Returns the list of (url, expected approval status) that did not match.
+		Those that could not be read (e.g. a transient Hub error) are logged and counted as unverified
+		'''
+		sample = random.sample(
+			self.updated_component_urls, min(self.verify_sample_size, len(self.updated_component_urls)))
+		mismatched = []
+		unverified = 0
+		for component_url, expected_approval_status in sample:
+			try:
+				component_or_version_details, etag = self._fetch_component(component_url)
+			except:
+				logging.warning("Could not read Hub component/version {} to verify it".format(component_url), exc_info=True)
+				unverified += 1
+				continue
+			approval_status = component_or_version_details.get('approvalStatus')
+			if approval_status != expected_approval_status:
+				logging.warning("Hub component/version {} has approval status {}, expected {}".format(
+					component_url, approval_status, expected_approval_status))
+				mismatched.append((component_url, expected_approval_status))
+		logging.info("Verified {} updated suite components or component versions, {} did not match, {} could not be read".format(
+			len(sample) - unverified, len(mismatched), unverified))
+		return mismatched
+
 	def _get_protex_info(self, suite_component_info):
 		'''Given a row from the CSV file, with the Suite component info, return the Protex
 		component id, release/version id, and approval status
@@ -138,21 +249,27 @@ class CodeCenterComponentImport(object):
 		protex_approval_status = 'NOT_REVIEWED'
 		return self._update_approval_status(protex_component_id, protex_approval_status, protex_release_id)
 
+	def _export_reader(self):
+		# The required columns are checked once, when the header is read, rather than for every row
+		return CodeCenterExportReader(
+			self.component_approval_status_export_file,
+			required_columns=CodeCenterComponentImport.REQUIRED_COL_NAMES,
+			workers=self.reader_workers)
+
 	def reset_components_to_unreviewed(self):
 		'''Parse a given CSV file and reset the approval status (in Hub) for any components found
 		'''
-		with open(args.component_approval_status_export, newline='') as component_list_file:
-			reader = csv.DictReader(component_list_file, delimiter="|")
-			for suite_component_info in reader:
-				component_type = "STANDARD" 
-				if component_type in CodeCenterComponentImport.SUPPORTED_COMPONENT_TYPES:
-					try:
+		for suite_component_info in self._export_reader():
+			component_type = "STANDARD" 
+			if component_type in CodeCenterComponentImport.SUPPORTED_COMPONENT_TYPES:
+				try:
+					with self.profiler.phase("update hub"):
 						self._set_hub_component_to_unreviewd(suite_component_info)
-					except:
-						logging.error("Failed to set component to unreviewed: {}".format(suite_component_info), exc_info=True)
-				else:
-					logging.debug("component type {} not in support component types ({})".format(
-						component_type, CodeCenterComponentImport.SUPPORTED_COMPONENT_TYPES))
+				except:
+					logging.error("Failed to set component to unreviewed: {}".format(suite_component_info), exc_info=True)
+			else:
+				logging.debug("component type {} not in support component types ({})".format(
+					component_type, CodeCenterComponentImport.SUPPORTED_COMPONENT_TYPES))
 
 	def _reconcile_component_approvals(self, component_name_and_version, component_approvals):
 		# Given a list of component approvals (for the same component/name), determine if there is
@@ -183,19 +300,19 @@ class CodeCenterComponentImport(object):
 		be more than one approval request per component. And if there are > 1 approval requests for
 		any given component there is potentially a conflict which we must reconcile.
 		'''
-		with open(args.component_approval_status_export, newline='') as component_list_file:
-			reader = csv.DictReader(component_list_file, delimiter="|")
-			updated = []
-			conflicts = []
-			failed = []
-			equivalent = []
-
-			#
-			# Read all rows from the CSV file to compile a list of all
-			# component approval requests and create a set of component names/versions
-			#
-			all_rows_by_component_name_and_version = list()
-			all_component_names_and_versions = set()
+		reader = self._export_reader()
+		updated = []
+		conflicts = []
+		failed = []
+		equivalent = []
+
+		#
+		# Read all rows from the CSV file to compile a list of all
+		# component approval requests and create a set of component names/versions
+		#
+		all_rows_by_component_name_and_version = list()
+		all_component_names_and_versions = set()
+		with self.profiler.phase("read export"):
 			for row in reader:
 				# list of tuples, first element is the key (component_name:component_version), 2nd element is the 
 				# row or suite_component_info 
@@ -206,65 +323,74 @@ class CodeCenterComponentImport(object):
 				all_component_names_and_versions.add(
 					"{}:{}".format(row['component_name'], row['component_version']))
 
-			#
-			# look for any duplicate component approval requests and reconcile their approval status values 
-			# to decide whether we can update the component approval status in the Hub
-			#
-			for component_name_and_version in all_component_names_and_versions:
+		#
+		# look for any duplicate component approval requests and reconcile their approval status values 
+		# to decide whether we can update the component approval status in the Hub
+		#
+		for component_name_and_version in all_component_names_and_versions:
+			with self.profiler.phase("group approvals"):
 				component_approvals = [
 					r[1] for r in all_rows_by_component_name_and_version if component_name_and_version == r[0]]
-				if len(component_approvals) == 1:
-					suite_component_info = component_approvals[0]
-				elif len(component_approvals) > 1:
-					try:
+			if len(component_approvals) == 1:
+				suite_component_info = component_approvals[0]
+			elif len(component_approvals) > 1:
+				try:
+					with self.profiler.phase("reconcile approvals"):
 						suite_component_info = self._reconcile_component_approvals(
 							component_name_and_version, component_approvals)
-					except ApprovalStatusConflict:
-						conflicts.extend(component_approvals)
-						logging.warning(
-							"The component {} could not be imported due to an approval status conflict among the CC component approval requests ({})".format(
-								component_name_and_version, component_approvals))
-						continue
-				else:
-					logging.error("What? This is a bug cause we should never have 0 component approvals")
+				except ApprovalStatusConflict:
+					conflicts.extend(component_approvals)
+					logging.warning(
+						"The component {} could not be imported due to an approval status conflict among the CC component approval requests ({})".format(
+							component_name_and_version, component_approvals))
 					continue
-
-				#
-				# Update the Hub component approval status
-				#
-				result = self._import_component(suite_component_info)
-				if result == 'Updated':
-					logging.info("Updated the Hub with suite component: {}".format(suite_component_info))
-					updated.append(suite_component_info)
-				elif result == 'Equal':
-					logging.debug(
-						"Suite component approval status in Protex is effectively equal to the Hub for component: {}".format(
-							suite_component_info))
-					equivalent.append(suite_component_info)
-				else:
-					logging.warn("Failed to update suite component: {}".format(suite_component_info))
-					failed.append(suite_component_info)
+			else:
+				logging.error("What? This is a bug cause we should never have 0 component approvals")
+				continue
 
 			#
-			# Dump the results
+			# Update the Hub component approval status
 			#
-			logging.info("Updated {} suite components or component versions".format(len(updated)))
-			self._dump_updated_to_file(updated)
-
-			if len(equivalent) > 0:
-				logging.info("Did not update {} suite components because the approval status they map to is equal to the existing Hub component approval status".format(
-					len(equivalent)))
-				self._dump_equivalent_to_file(equivalent)
-
-			if len(failed) > 0:
-				logging.info("Failed to update {} suite components or component versions".format(len(failed)))
-				self._dump_failed_to_file(failed)
-			if len(conflicts) > 0:
-				logging.info(
-					"Skipped {} suite components or component versions because there were approval status conflicts".format(
-						len(conflicts))
-					)
-				self._dump_conflicts(conflicts)
+			with self.profiler.phase("update hub"):
+				result = self._import_component(suite_component_info)
+			if result == 'Updated':
+				logging.info("Updated the Hub with suite component: {}".format(suite_component_info))
+				updated.append(suite_component_info)
+			elif result == 'Equal':
+				logging.debug(
+					"Suite component approval status in Protex is effectively equal to the Hub for component: {}".format(
+						suite_component_info))
+				equivalent.append(suite_component_info)
+			else:
+				logging.warn("Failed to update suite component: {}".format(suite_component_info))
+				failed.append(suite_component_info)
+
+		#
+		# Dump the results
+		#
+		logging.info("Updated {} suite components or component versions".format(len(updated)))
+		logging.debug("Made {} Hub component lookups, {} more were served by an earlier lookup".format(
+			self.hub_lookups, self.hub_lookups_reused))
+		self._dump_updated_to_file(updated)
+
+		if len(equivalent) > 0:
+			logging.info("Did not update {} suite components because the approval status they map to is equal to the existing Hub component approval status".format(
+				len(equivalent)))
+			self._dump_equivalent_to_file(equivalent)
+
+		if len(failed) > 0:
+			logging.info("Failed to update {} suite components or component versions".format(len(failed)))
+			self._dump_failed_to_file(failed)
+		if len(conflicts) > 0:
+			logging.info(
+				"Skipped {} suite components or component versions because there were approval status conflicts".format(
+					len(conflicts))
+				)
+			self._dump_conflicts(conflicts)
+
+		if self.verify_sample_size > 0:
+			with self.profiler.phase("verify updates"):
+				self.verify_updates()
 
 	def _dump_updated_to_file(self, updated):
 		import pdb; pdb.set_trace()
@@ -314,6 +440,11 @@ if __name__ == "__main__":
 	parser.add_argument("component_approval_status_export", help="Pipe-delimited file containing the component information from the Code Center catalog (i.e. global component approval statuses")
 	parser.add_argument("-l", "--loglevel", choices=["CRITICAL", "DEBUG", "ERROR", "INFO", "WARNING"], default="DEBUG", help="Choose the desired logging level - CRITICAL, DEBUG, ERROR, INFO, or WARNING. (default: DEBUG)")
 	parser.add_argument("-r", "--reset_approval_status", action='store_true', help="Reset the Hub component approval status (corresponding to the Protex component) to un-reviewed")
+	parser.add_argument("-p", "--profile", choices=PhaseProfiler.MODES, help="Report the wall time and network wait time of each phase of the run and, with 'cprofile', the hot functions")
+	parser.add_argument("-w", "--reader_workers", type=int, help="Number of processes used to parse the export (default: number of CPUs)")
+	parser.add_argument("-c", "--connection_pool_size", type=int, default=1, help="Number of (keep-alive) connections to the Hub to keep in the pool, one per thread making Hub calls (default: 1)")
+	parser.add_argument("-t", "--timeout", type=float, default=60, help="Timeout, in seconds, for each request to the Hub (default: 60)")
+	parser.add_argument("--verify_sample_size", type=int, default=0, help="Number of updated components to re-read from the Hub, at the end of the run, to verify their approval status (default: 0)")
 	args = parser.parse_args()
 
 	logging_levels = {
@@ -327,16 +458,35 @@ if __name__ == "__main__":
 	logging.getLogger("requests").setLevel(logging.WARNING)
 	logging.getLogger("urllib3").setLevel(logging.WARNING)
 
-	hub = HubInstance()
-
-	protex_importer = CodeCenterComponentImport(args.component_approval_status_export, hub)
+	profiler = PhaseProfiler(args.profile)
+	profiler.start()
 
-	if args.reset_approval_status:
-		logging.debug("resetting components to un-reviewed")
-		protex_importer.reset_components_to_unreviewed()
-	else:
-		logging.debug("import component approval status")
-		protex_importer.import_components()
+	hub = HubInstance()
+	transport = HubTransport(pool_size=args.connection_pool_size, timeout=args.timeout)
+	transport.install(hub)
+
+	protex_importer = CodeCenterComponentImport(
+		args.component_approval_status_export, hub, verify_sample_size=args.verify_sample_size, profiler=profiler,
+		reader_workers=args.reader_workers)
+
+	try:
+		if args.reset_approval_status:
+			logging.debug("resetting components to un-reviewed")
+			with profiler.phase("reset components"):
+				protex_importer.reset_components_to_unreviewed()
+		else:
+			logging.debug("import component approval status")
+			with profiler.phase("import components"):
+				protex_importer.import_components()
+	except InvalidExportFile as e:
+		logging.error(e)
+		sys.exit(1)
+	finally:
+		logging.info(transport.report())
+		transport.close()
+		profiler.stop()
+		if profiler.enabled:
+			logging.info("Profile:\n{}".format(profiler.report()))
 
 
 
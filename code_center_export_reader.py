@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import logging
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+class InvalidExportFile(Exception):
+	pass
+
+
+def _parse_chunk(export_file, start, end, num_columns):
+	# Runs in a worker process, parses the lines in [start, end) of the export into tuples of field values
+	with open(export_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as export_mmap:
+		data = export_mmap[start:end].decode('utf-8')
+	rows = []
+	malformed = 0
+	for line in data.split('\n'):
+		line = line.rstrip('\r')
+		if not line:
+			continue
+		fields = line.split('|')
+		if len(fields) == num_columns:
+			rows.append(tuple(fields))
+		else:
+			malformed += 1
+	return (rows, malformed)
+
+
+class CodeCenterExportReader(object):
+	'''Reads a pipe-delimited ("|") Code Center export, as produced by psql -A, i.e. a header row followed by one
+	row per line with no quoting.
+
+	The header is read, and checked for the required columns, once up front. The rest of the file is memory-mapped,
+	split on line boundaries into chunks of roughly chunk_size bytes, and the chunks are parsed in parallel by
+	up to workers processes. Rows are yielded, in file order, as dicts keyed by the (shared) header names so
+	they can be used anywhere a csv.DictReader row was.
+
+	Rows that do not have the same number of fields as the header are skipped and counted in self.malformed.
+	'''
+	def __init__(self, export_file, required_columns=(), workers=None, chunk_size=16 * 1024 * 1024):
+		self.export_file = export_file
+		self.required_columns = required_columns
+		self.workers = workers or os.cpu_count() or 1
+		self.chunk_size = chunk_size
+		self.fieldnames = None
+		self.malformed = 0
+
+	def _read_header(self, export_mmap):
+		header_end = export_mmap.find(b'\n')
+		header_end = len(export_mmap) if header_end == -1 else header_end + 1
+		fieldnames = export_mmap[:header_end].decode('utf-8').rstrip('\r\n').split('|')
+		missing = [c for c in self.required_columns if c not in fieldnames]
+		if missing:
+			raise InvalidExportFile("{} is missing the required column(s) {}, found {}".format(
+				self.export_file, missing, fieldnames))
+		return (fieldnames, header_end)
+
+	def _chunks(self, export_mmap, start):
+		size = len(export_mmap)
+		while start < size:
+			end = export_mmap.find(b'\n', start + self.chunk_size)
+			end = size if end == -1 else end + 1
+			yield (start, end)
+			start = end
+
+	def _parsed_chunks(self, chunks):
+		num_columns = len(self.fieldnames)
+		if self.workers == 1 or len(chunks) == 1:
+			for start, end in chunks:
+				yield _parse_chunk(self.export_file, start, end, num_columns)
+			return
+		# Keep a bounded number of chunks in flight so memory use does not grow with the size of the file
+		with ProcessPoolExecutor(max_workers=self.workers) as executor:
+			in_flight = deque()
+			for start, end in chunks:
+				in_flight.append(executor.submit(_parse_chunk, self.export_file, start, end, num_columns))
+				if len(in_flight) >= 2 * self.workers:
+					yield in_flight.popleft().result()
+			while in_flight:
+				yield in_flight.popleft().result()
+
+	def __iter__(self):
+		if os.path.getsize(self.export_file) == 0:
+			raise InvalidExportFile("{} is empty".format(self.export_file))
+		with open(self.export_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as export_mmap:
+			self.fieldnames, header_end = self._read_header(export_mmap)
+			chunks = list(self._chunks(export_mmap, header_end))
+
+		self.malformed = 0
+		fieldnames = self.fieldnames
+		for rows, malformed in self._parsed_chunks(chunks):
+			self.malformed += malformed
+			for row in rows:
+				yield dict(zip(fieldnames, row))
+		if self.malformed > 0:
+			logging.warning("Skipped {} rows in {} that did not have {} fields".format(
+				self.malformed, self.export_file, len(fieldnames)))
+
+
+if __name__ == "__main__":
+	import argparse
+	import csv
+	import sys
+	import time
+
+	parser = argparse.ArgumentParser("Benchmark reading a pipe-delimited Code Center export with CodeCenterExportReader vs. csv.DictReader")
+	parser.add_argument("export_file", help="Pipe-delimited Code Center export")
+	parser.add_argument("-w", "--workers", type=int, help="Number of parser processes (default: number of CPUs)")
+	parser.add_argument("-c", "--chunk_size", type=int, default=16 * 1024 * 1024, help="Approximate size, in bytes, of each chunk parsed by a worker (default: 16MB)")
+	args = parser.parse_args()
+
+	logging.basicConfig(stream=sys.stdout, format='%(threadName)s: %(asctime)s: %(levelname)s: %(message)s', level=logging.INFO)
+
+	start = time.perf_counter()
+	with open(args.export_file, newline='') as export_file:
+		dict_reader_rows = sum(1 for row in csv.DictReader(export_file, delimiter="|"))
+	dict_reader_time = time.perf_counter() - start
+
+	start = time.perf_counter()
+	reader_rows = sum(1 for row in CodeCenterExportReader(args.export_file, workers=args.workers, chunk_size=args.chunk_size))
+	reader_time = time.perf_counter() - start
+
+	logging.info("csv.DictReader: {} rows in {:.3f}s ({:.0f} rows/s)".format(
+		dict_reader_rows, dict_reader_time, dict_reader_rows / dict_reader_time if dict_reader_time else 0))
+	logging.info("CodeCenterExportReader: {} rows in {:.3f}s ({:.0f} rows/s)".format(
+		reader_rows, reader_time, reader_rows / reader_time if reader_time else 0))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import json
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HubTransport(object):
+	'''A pooled, keep-alive HTTP session for talking to the Hub.
+
+	install() points a HubInstance's execute_get/put/post/delete at the session and, since some HubInstance
+	methods (e.g. get_project_versions, get_version_components and so get_version_by_name) call requests.get/put/etc
+	directly, also routes the requests module's calls to that Hub through it. So every Hub call re-uses pooled
+	connections instead of opening a new connection (and TLS handshake) per request, and report() covers all of them.
+
+	pool_size is the number of connections kept per host and should be the number of threads making Hub calls
+	concurrently, which is one for the scripts in this repo.
+	'''
+	def __init__(self, pool_size=1, timeout=60, compress=True):
+		self.pool_size = pool_size
+		self.timeout = timeout
+		self.hub_urls = []
+		self._module_request = None
+		self.session = requests.Session()
+		self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+		self.session.mount('https://', self.adapter)
+		self.session.mount('http://', self.adapter)
+		self.session.headers['Connection'] = 'keep-alive'
+		self.session.headers['Accept-Encoding'] = 'gzip, deflate' if compress else 'identity'
+
+	def install(self, hub_instance):
+		transport = self
+		def _request(method, url, custom_headers={}, data=None):
+			headers = hub_instance.get_headers()
+			if data is not None:
+				headers['Content-Type'] = 'application/json'
+				if isinstance(data, dict) or isinstance(data, list):
+					data = json.dumps(data)
+			headers.update(custom_headers)
+			return transport.session.request(
+				method, url, headers=headers, data=data, verify=not hub_instance.config['insecure'], timeout=transport.timeout)
+
+		hub_instance.execute_get = lambda url, custom_headers={}: _request('GET', url, custom_headers)
+		hub_instance.execute_put = lambda url, data, custom_headers={}: _request('PUT', url, custom_headers, data)
+		hub_instance.execute_post = lambda url, data, custom_headers={}: _request('POST', url, custom_headers, data)
+		hub_instance.execute_delete = lambda url: _request('DELETE', url)
+		self._route_module_requests(hub_instance.config['baseurl'])
+		return hub_instance
+
+	def _route_module_requests(self, hub_url):
+		# requests.get/put/post/delete all call requests.api.request, which makes a new session (and connection)
+		# per call. Calls to the Hub are sent through the pooled session instead, anything else is left alone
+		self.hub_urls.append(hub_url)
+		if self._module_request is not None:
+			return
+		transport = self
+		module_request = self._module_request = requests.api.request
+		def _request(method, url, **kwargs):
+			if not any(url.startswith(hub_url) for hub_url in transport.hub_urls):
+				return module_request(method, url, **kwargs)
+			kwargs.setdefault('timeout', transport.timeout)
+			return transport.session.request(method, url, **kwargs)
+		requests.api.request = _request
+
+	def connection_stats(self):
+		'''Returns a tuple of (connections opened, requests made) across all of the session's connection pools
+		'''
+		connections = 0
+		num_requests = 0
+		pools = self.adapter.poolmanager.pools
+		for key in pools.keys():
+			pool = pools.get(key)
+			if pool:
+				connections += pool.num_connections
+				num_requests += pool.num_requests
+		return (connections, num_requests)
+
+	def report(self):
+		connections, num_requests = self.connection_stats()
+		reuse_ratio = 1.0 - float(connections) / num_requests if num_requests else 0.0
+		return "Made {} Hub requests over {} connections (connection reuse ratio {:.2f})".format(
+			num_requests, connections, reuse_ratio)
+
+	def close(self):
+		if self._module_request is not None:
+			requests.api.request = self._module_request
+			self._module_request = None
+		self.session.close()
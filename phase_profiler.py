@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+
+class PhaseProfiler(object):
+	'''Time the named phases of a run, and how much of each phase was spent waiting on HTTP requests, and
+	optionally run cProfile over the run to rank the hot functions.
+
+	Phases can be nested, a phase's times include those of the phases nested in it. A disabled profiler
+	(mode=None) does nothing, so the phases can stay in place in the code.
+	'''
+	MODES = ['phases', 'cprofile']
+
+	def __init__(self, mode=None, top_functions=25):
+		self.mode = mode
+		self.top_functions = top_functions
+		# phase name -> [entries, wall time, requests, network wait time], kept in the order phases were first entered
+		self.phases = {}
+		self._local = threading.local()
+		self._lock = threading.Lock()
+		self._cprofile = None
+		self._original_request = None
+
+	@property
+	def enabled(self):
+		return self.mode is not None
+
+	def _phase_stack(self):
+		if not hasattr(self._local, 'stack'):
+			self._local.stack = []
+		return self._local.stack
+
+	def _phase_stats(self, name):
+		if name not in self.phases:
+			self.phases[name] = [0, 0.0, 0, 0.0]
+		return self.phases[name]
+
+	def _add_network_wait(self, elapsed):
+		with self._lock:
+			for name in self._phase_stack():
+				stats = self._phase_stats(name)
+				stats[2] += 1
+				stats[3] += elapsed
+
+	def start(self):
+		if not self.enabled:
+			return
+		# Everything the Hub client does goes through requests so timing Session.request captures the network waits
+		self._original_request = original_request = requests.Session.request
+		profiler = self
+		def _timed_request(session, *args, **kwargs):
+			start = time.perf_counter()
+			try:
+				return original_request(session, *args, **kwargs)
+			finally:
+				profiler._add_network_wait(time.perf_counter() - start)
+		requests.Session.request = _timed_request
+
+		if self.mode == 'cprofile':
+			self._cprofile = cProfile.Profile()
+			self._cprofile.enable()
+
+	def stop(self):
+		if self._cprofile:
+			self._cprofile.disable()
+		if self._original_request:
+			requests.Session.request = self._original_request
+			self._original_request = None
+
+	@contextmanager
+	def phase(self, name):
+		if not self.enabled:
+			yield
+			return
+		stack = self._phase_stack()
+		with self._lock:
+			self._phase_stats(name)
+		stack.append(name)
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			stack.pop()
+			with self._lock:
+				stats = self._phase_stats(name)
+				stats[0] += 1
+				stats[1] += elapsed
+
+	def report(self):
+		'''Returns the per-phase wall time vs. network wait breakdown and, if cProfile was run, the hot functions
+		ranked by the time spent in them
+		'''
+		lines = ["{:<40} {:>8} {:>10} {:>9} {:>12} {:>9}".format(
+			"Phase", "Entries", "Wall (s)", "Requests", "Network (s)", "Network %")]
+		for name, (entries, wall_time, num_requests, network_wait) in self.phases.items():
+			lines.append("{:<40} {:>8} {:>10.3f} {:>9} {:>12.3f} {:>9.1f}".format(
+				name, entries, wall_time, num_requests, network_wait,
+				100.0 * network_wait / wall_time if wall_time else 0.0))
+		if self._cprofile:
+			stats_output = io.StringIO()
+			stats = pstats.Stats(self._cprofile, stream=stats_output)
+			stats.sort_stats('tottime').print_stats(self.top_functions)
+			lines.append(stats_output.getvalue())
+		return "\n".join(lines)
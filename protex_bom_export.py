@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+import hashlib
+import logging
+import os
+import re
+import shlex
+import signal
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class ProtexBomExportFailed(Exception):
+	pass
+
+
+class ProtexBomExporter(object):
+	'''Export the BOMs for many Protex projects using the Protex BOM export tool (scan.protex.cli.sh),
+	running up to max_workers exports at a time. An export that runs for more than export_timeout seconds (e.g. one
+	stuck at a password prompt) is killed, along with everything it started (the tool is a shell wrapper around a JVM),
+	and retried like any other failed export.
+
+	The tool prompts for the Protex password, protex_password (if given) is written to its standard input to answer
+	that prompt. Without it the tool's standard input is closed and an export that needs the password fails.
+
+	Each completed export is passed to the (optional) on_export_complete callable as soon as it is done,
+	on a separate pool, so downstream work (e.g. importing the BOM and reconciling snippet matches) overlaps
+	with the remaining exports.
+	'''
+	EXPORT_SCRIPT = 'scan.protex.cli.sh'
+	DEFAULT_OUTPUT_FILE_NAME = 'protex_bom_export.json'
+
+	def __init__(
+			self, protex_server_host, protex_username, output_dir, protex_server_port=443, export_script=None,
+			max_workers=4, retries=2, retry_delay=5, on_export_complete=None, downstream_workers=1, export_timeout=3600,
+			protex_password=None):
+		self.protex_server_host = protex_server_host
+		self.protex_server_port = protex_server_port
+		self.protex_username = protex_username
+		self.output_dir = output_dir
+		self.export_script = export_script or ProtexBomExporter.EXPORT_SCRIPT
+		self.max_workers = max_workers
+		self.retries = retries
+		self.retry_delay = retry_delay
+		self.on_export_complete = on_export_complete
+		self.downstream_workers = downstream_workers
+		self.export_timeout = export_timeout
+		self.protex_password = protex_password
+
+	def _project_output_dir(self, project_name):
+		# One directory per project so concurrent exports never write to the same place. The hash of the name keeps
+		# projects whose names only differ in the characters replaced (e.g. 'a/b' and 'a_b') apart
+		return os.path.join(self.output_dir, "{}_{}".format(
+			re.sub(r'[^A-Za-z0-9._-]', '_', project_name), hashlib.sha1(project_name.encode('utf-8')).hexdigest()[:8]))
+
+	def _export_command(self, project_name, project_output_dir):
+		return [
+			self.export_script,
+			'--address', '{}:{}'.format(self.protex_server_host, self.protex_server_port),
+			'--project', project_name,
+			'--user', self.protex_username,
+			'--include-files', '--dryRunWriteDir', project_output_dir,
+			'--output', ProtexBomExporter.DEFAULT_OUTPUT_FILE_NAME,
+			'--secure', '--verbose',
+		]
+
+	def _export_project_once(self, project_name):
+		project_output_dir = self._project_output_dir(project_name)
+		os.makedirs(project_output_dir, exist_ok=True)
+		export_file = os.path.join(project_output_dir, ProtexBomExporter.DEFAULT_OUTPUT_FILE_NAME)
+		if os.path.exists(export_file):
+			# don't let a stale file from a previous (failed) attempt pass the output check below
+			os.remove(export_file)
+
+		log_file = os.path.join(project_output_dir, 'export.log')
+		with open(log_file, 'w') as export_log:
+			# In its own session (process group) so a hung export can be killed along with the processes it started,
+			# which would otherwise keep writing to project_output_dir while the export is retried
+			process = subprocess.Popen(
+				self._export_command(project_name, project_output_dir),
+				stdin=subprocess.PIPE, stdout=export_log, stderr=subprocess.STDOUT, start_new_session=True)
+			password_input = (self.protex_password + "\n").encode('utf-8') if self.protex_password else None
+			try:
+				process.communicate(input=password_input, timeout=self.export_timeout)
+			except subprocess.TimeoutExpired:
+				raise ProtexBomExportFailed("Export of {} did not finish within {} seconds, see {}".format(
+					project_name, self.export_timeout, log_file))
+			finally:
+				if process.returncode is None:
+					os.killpg(process.pid, signal.SIGKILL)
+					process.wait()
+
+		if process.returncode != 0:
+			raise ProtexBomExportFailed("Export of {} exited with status {}, see {}".format(
+				project_name, process.returncode, log_file))
+		if not os.path.exists(export_file) or os.path.getsize(export_file) == 0:
+			raise ProtexBomExportFailed("Export of {} did not produce {}, see {}".format(
+				project_name, export_file, log_file))
+		return export_file
+
+	def export_project(self, project_name):
+		'''Export a single Protex project, retrying up to self.retries times. Returns the path to the export file
+		or raises ProtexBomExportFailed if every attempt failed
+		'''
+		for attempt in range(1, self.retries + 2):
+			logging.debug("Exporting {} from server {} (attempt {})".format(project_name, self.protex_server_host, attempt))
+			try:
+				export_file = self._export_project_once(project_name)
+			except (ProtexBomExportFailed, OSError) as e:
+				if attempt > self.retries:
+					raise ProtexBomExportFailed(str(e))
+				logging.warning("{}, retrying in {} seconds".format(e, self.retry_delay))
+				time.sleep(self.retry_delay)
+			else:
+				logging.info("Exported BOM info for {} to {}".format(project_name, export_file))
+				return export_file
+
+	def _run_downstream(self, project_name, export_file):
+		try:
+			self.on_export_complete(project_name, export_file)
+		except:
+			logging.error("Downstream processing failed for {} ({})".format(project_name, export_file), exc_info=True)
+			return False
+		return True
+
+	def export_projects(self, project_names):
+		'''Export all the given projects. Returns a tuple of (exported, failed) where exported maps project name to
+		export file and failed is the list of project names whose export (or downstream processing) failed
+		'''
+		exported = {}
+		failed = []
+		downstream_futures = {}
+		with ThreadPoolExecutor(max_workers=self.downstream_workers) as downstream_pool:
+			with ThreadPoolExecutor(max_workers=self.max_workers) as export_pool:
+				export_futures = {export_pool.submit(self.export_project, p): p for p in project_names}
+				for future in as_completed(export_futures):
+					project_name = export_futures[future]
+					try:
+						export_file = future.result()
+					except ProtexBomExportFailed:
+						logging.error("Failed to export {}".format(project_name), exc_info=True)
+						failed.append(project_name)
+						continue
+					exported[project_name] = export_file
+					if self.on_export_complete:
+						downstream_futures[downstream_pool.submit(self._run_downstream, project_name, export_file)] = project_name
+
+			for future in as_completed(downstream_futures):
+				if not future.result():
+					failed.append(downstream_futures[future])
+
+		logging.info("Exported {} of {} Protex projects".format(len(exported), len(project_names)))
+		if len(failed) > 0:
+			logging.info("Failed to export or process {} Protex projects: {}".format(len(failed), failed))
+		return (exported, failed)
+
+
+def downstream_command_runner(command_template):
+	'''Returns an on_export_complete callable that runs the given command (a shell-style string with
+	{project_name} and {export_file} placeholders) for each completed export
+	'''
+	def _run(project_name, export_file):
+		command = [
+			arg.format(project_name=project_name, export_file=export_file) for arg in shlex.split(command_template)]
+		logging.debug("Running downstream command {}".format(command))
+		subprocess.run(command, check=True)
+	return _run
+
+
+if __name__ == "__main__":
+	import argparse
+	import getpass
+	import sys
+
+	parser = argparse.ArgumentParser(
+		"Export the BOMs for a list of Protex projects, running several exports concurrently",
+		epilog="The Protex password is read from the PROTEX_PASSWORD environment variable or, if that is not set, prompted for once")
+	parser.add_argument("project_list", help="File containing the Protex project names to export, one per line")
+	parser.add_argument("protex_server_host", help="The Protex server host name")
+	parser.add_argument("protex_username", help="The Protex user to export with")
+	parser.add_argument("-p", "--protex_server_port", default=443, help="The Protex server port (default: 443)")
+	parser.add_argument("-o", "--output_dir", default="./", help="Directory under which each project's export is written, one sub-directory per project (default: ./)")
+	parser.add_argument("-e", "--export_script", default=os.path.join(os.environ.get('SCAN_PROTEX_CLI_PATH', ''), ProtexBomExporter.EXPORT_SCRIPT), help="Path to the Protex BOM export tool (default: $SCAN_PROTEX_CLI_PATH/{})".format(ProtexBomExporter.EXPORT_SCRIPT))
+	parser.add_argument("-w", "--workers", type=int, default=4, help="Maximum number of exports to run concurrently (default: 4)")
+	parser.add_argument("-t", "--export_timeout", type=float, default=3600, help="Number of seconds after which an export is killed and counted as failed (default: 3600)")
+	parser.add_argument("-r", "--retries", type=int, default=2, help="Number of times to retry a failed export (default: 2)")
+	parser.add_argument("-d", "--downstream_command", help="Command to run for each completed export, while the remaining exports continue, e.g. 'python reconcile_snippet_matches.py {project_name} my_version'. Supports {project_name} and {export_file} placeholders")
+	parser.add_argument("-l", "--loglevel", choices=["CRITICAL", "DEBUG", "ERROR", "INFO", "WARNING"], default="DEBUG", help="Choose the desired logging level - CRITICAL, DEBUG, ERROR, INFO, or WARNING. (default: DEBUG)")
+	args = parser.parse_args()
+
+	logging_levels = {
+		'CRITICAL': logging.CRITICAL,
+		'DEBUG': logging.DEBUG,
+		'ERROR': logging.ERROR,
+		'INFO': logging.INFO,
+		'WARNING': logging.WARNING,
+	}
+	logging.basicConfig(stream=sys.stdout, format='%(threadName)s: %(asctime)s: %(levelname)s: %(message)s', level=logging_levels[args.loglevel])
+
+	with open(args.project_list) as project_list_file:
+		project_names = [line.strip() for line in project_list_file if line.strip()]
+
+	exporter = ProtexBomExporter(
+		args.protex_server_host,
+		args.protex_username,
+		args.output_dir,
+		protex_server_port=args.protex_server_port,
+		export_script=args.export_script,
+		max_workers=args.workers,
+		retries=args.retries,
+		export_timeout=args.export_timeout,
+		on_export_complete=downstream_command_runner(args.downstream_command) if args.downstream_command else None,
+		protex_password=os.environ.get('PROTEX_PASSWORD') or getpass.getpass("Protex password for {}: ".format(args.protex_username)))
+	exported, failed = exporter.export_projects(project_names)
+	sys.exit(1 if failed else 0)
@@ -8,14 +8,15 @@ a Protex BOM import
 
 '''
 from blackduck.HubRestApi import HubInstance, object_id
+from hub_transport import HubTransport
+from phase_profiler import PhaseProfiler
+from snippet_reconciliation_state import SnippetReconciliationState
 import sys
 import json
 import copy
 import argparse
 import logging
 
-hub = HubInstance()
-
 parser = argparse.ArgumentParser(
     description="Reconcile snippet matches in a BD Hub project-version against a project-version created by a Protex BOM import",
     formatter_class=argparse.RawTextHelpFormatter)
@@ -40,7 +41,41 @@ parser.add_argument(
     action='store_true', 
     help="""Override the snippet match component info with the component info from the Protex BOM import if the Hub 
 snippet matches do not contain an equivalent component. \nWARNING: Snippet source file info will be disassociated so use with care.""")
-args = parser.parse_args()
+parser.add_argument(
+    '--page_size', 
+    type=int,
+    default=1000, 
+    help="""Number of items to request per page when reading snippet matches, BOM components, and component file matches 
+from the Hub. Only one page is held in memory at a time (default: 1000)""")
+parser.add_argument(
+    '--profile', 
+    choices=PhaseProfiler.MODES, 
+    help="""Report the wall time and network wait time of each phase of the run and, with 'cprofile', 
+the hot functions""")
+parser.add_argument(
+    '--connection_pool_size', 
+    type=int,
+    default=1, 
+    help="Number of (keep-alive) connections to the Hub to keep in the pool, one per thread making Hub calls (default: 1)")
+parser.add_argument(
+    '--timeout', 
+    type=float,
+    default=60, 
+    help="Timeout, in seconds, for each request to the Hub (default: 60)")
+parser.add_argument(
+    '--state_dir', 
+    help="""Directory in which to keep the reconciliation state of each project-version. When given, re-runs re-use the 
+Protex BOM path index if the Protex BOM import is unchanged, and skip the snippet matches already decided on""")
+
+# Set up when run as a script, so the functions below can be imported without parsing the command line or
+# connecting to a Hub
+args = None
+hub = None
+profiler = PhaseProfiler()
+
+# Number of snippet matches to reconcile between saves of the reconciliation state, so an interrupted run
+# keeps most of its decisions
+STATE_SAVE_INTERVAL = 100
 
 
 # Get the Bom Components for a Project ID + Version ID Pair
@@ -51,38 +86,111 @@ args = parser.parse_args()
 
 
 
-def get_snippet_path_map(snippet_entries):
-    # Build a map by snippet source file path for all the snippet matches in the given snippet bom entries object
-    snippet_map = {}
-    for cur_snippet in snippet_entries['items']:
+def iter_paged_items(url, page_size=1000):
+    # Generator yielding the 'items' of a paged Hub collection one page at a time
+    # Only the current page of the raw response is held in memory, so callers that keep just the
+    # fields they need scale with what they keep rather than with the size of the full collection
+    separator = "&" if "?" in url else "?"
+    offset = 0
+    while True:
+        page_url = "{}{}limit={}&offset={}".format(url, separator, page_size, offset)
+        response = hub.execute_get(page_url)
+        response.raise_for_status()
+        page = response.json()
+        items = page.get('items', [])
+        total_count = page.get('totalCount', 0)
+        del page
+        for item in items:
+            yield item
+        offset = offset + len(items)
+        if not items or offset >= total_count:
+            break
+
+def get_total_count(url):
+    # Read just the totalCount of a paged Hub collection
+    separator = "&" if "?" in url else "?"
+    response = hub.execute_get("{}{}limit=1&offset=0".format(url, separator))
+    response.raise_for_status()
+    return response.json().get('totalCount', 0)
+
+def get_snippet_bom_entries_url(project_id, version_id):
+    # Un-reviewed, un-included snippet matches, i.e. the same filter HubInstance.get_snippet_bom_entries uses by default
+    return "{}/internal/projects/{}/versions/{}/snippet-bom-entries?filter=bomReviewStatus:false&filter=bomInclusion:false".format(
+        hub.get_apibase(), project_id, version_id)
+
+def get_matched_files_url(project_id, version_id, component_id, component_version_id):
+    if component_version_id:
+        return "{}/projects/{}/versions/{}/components/{}/versions/{}/matched-files".format(
+            hub.get_apibase(), project_id, version_id, component_id, component_version_id)
+    else:
+        return "{}/projects/{}/versions/{}/components/{}/matched-files".format(
+            hub.get_apibase(), project_id, version_id, component_id)
+
+def get_protex_bom_components(protex_import_version, page_size=1000):
+    return list(iter_paged_items(hub.get_link(protex_import_version, "components"), page_size))
+
+def get_protex_matched_file_counts(project_id, protex_import_version_id, protex_bom_components):
+    # Number of files matched to each Protex BOM import component, keyed by SnippetReconciliationState.component_key
+    matched_file_counts = {}
+    for protex_bom_component in protex_bom_components:
+        protex_component_name, protex_version_name, protex_component_id, protex_component_version_id = bom_component_info(
+            protex_bom_component)
+        matched_file_counts[SnippetReconciliationState.component_key(protex_bom_component)] = get_total_count(
+            get_matched_files_url(project_id, protex_import_version_id, protex_component_id, protex_component_version_id))
+    return matched_file_counts
+
+def build_protex_path_index(project_id, protex_import_version_id, protex_bom_components, page_size=1000):
+    # Stream the file matches for each of the Protex BOM import components and build a map
+    #   source_file_path -> protex_bom_component
+    # Only the path is kept from each file match, the (comparatively few) BOM components are shared by reference
+    path_index = {}
+    for protex_bom_component in protex_bom_components:
+        protex_component_name, protex_version_name, protex_component_id, protex_component_version_id = bom_component_info(
+            protex_bom_component)
+        protex_component_str = "{}:{}".format(protex_component_name, protex_version_name)
+        matched_files_url = get_matched_files_url(
+            project_id, protex_import_version_id, protex_component_id, protex_component_version_id)
+        num_paths = 0
+        for cur_file in iter_paged_items(matched_files_url, page_size):
+            source_file_path = cur_file['filePath']['path']
+            num_paths = num_paths + 1
+            if source_file_path in path_index:
+                logging.debug("Path {} is already associated with another Protex component, ignoring it for {}".format(
+                    source_file_path, protex_component_str))
+                continue
+            path_index[source_file_path] = protex_bom_component
+        logging.debug("Found {} paths associated with {}".format(num_paths, protex_component_str))
+    return path_index
+
+def get_snippet_matches_for_path_index(project_id, version_id, path_index, page_size=1000, state=None):
+    # Stream the snippet matches in the target version and keep only those whose source file path is
+    # in the Protex path index, and (given a reconciliation state) that were not already decided on in an earlier run.
+    # Returns a map/dict with the structure reconcile_snippet_matches expects,
+    #   source_file_path -> (protex_bom_component_info, hub snippet match info)
+    hub_snippet_matches_by_file_path = {}
+    num_snippets = 0
+    num_already_reconciled = 0
+    for cur_snippet in iter_paged_items(get_snippet_bom_entries_url(project_id, version_id), page_size):
+        num_snippets = num_snippets + 1
         path = cur_snippet['compositePath']['path']
-        if path in snippet_map:
-            logging.debug("Possible overwrite of snippet in map - more than on snippet for: ", path)
-        snippet_map[path] = cur_snippet
-    return snippet_map
-
-def get_component_file_map_by_path(bom_component_json, component_files, snippets):
-    # Find the intersection of source file paths in the component_files object
-    # with the source file paths in the given snippet matches map
-    # and build/return a new map that merges/associates the given bom component info with the snippet match info
-    component_path_map = {}
-    for cur_file in component_files['items']:
-        source_file_path = cur_file['filePath']['path']
-        if source_file_path in snippets:
-            component_path_map[source_file_path] = (bom_component_json, snippets[source_file_path])
-    return component_path_map
+        logging.debug(get_snippet_name_and_file_path(cur_snippet))
+        if path not in path_index:
+            continue
+        if state and state.is_reconciled(path, cur_snippet):
+            num_already_reconciled = num_already_reconciled + 1
+            continue
+        if path in hub_snippet_matches_by_file_path:
+            logging.debug("Possible overwrite of snippet in map - more than on snippet for: {}".format(path))
+        hub_snippet_matches_by_file_path[path] = (path_index[path], cur_snippet)
+    logging.debug("# Snippet Files: {}".format(num_snippets))
+    if state:
+        logging.debug("Skipped {} snippet matches that are unchanged since they were decided on in an earlier run".format(
+            num_already_reconciled))
+    return hub_snippet_matches_by_file_path
 
 def get_snippet_name_and_file_path(snippet_bom_entry):
     return str(snippet_bom_entry['name'] + " - " + snippet_bom_entry['compositePath']['path'])
 
-def get_snippet_names_and_file_paths(snippet_bom_entries):
-    # Gets the file paths that a snippet-bom-entries response represents
-    # This returns a flattened set of paths represented by the snippets
-    files = set()
-    for snippet_bom_entry in snippet_bom_entries['items']:
-        files.add(get_snippet_name_and_file_path(snippet_bom_entry))
-    return files
-
 def same_component(bom_component, snippet_match_component):
     b_name, b_version_name, b_id, b_version_id = bom_component_info(bom_component)
     s_name, s_version_name, s_id, s_version_id = snippet_component_info(snippet_match_component)
@@ -117,7 +225,8 @@ def reconcile_snippet_matches(
     target_version_id, 
     hub_snippet_matches_by_file_path, 
     override_snippet_component=False, 
-    use_best_match=False):
+    use_best_match=False,
+    decisions=None):
     # Reconcile the snippet matches in the given hub_snippet_matches_by_file_path map/dict
     #   map/dict structure is expected to be,
     #       source_file_path -> (protex_bom_component_info, hub snippet match info)
@@ -132,7 +241,12 @@ def reconcile_snippet_matches(
     #               The consequence of this is the snippet match will NOT have source file info associated with it
     #           If override_snippet_component is false, we skip the snippet match to allow the user to reconcile it manually
     # 
+    #   If given, the decisions map/dict is filled in with what was decided for each source file path, one of
+    #       'already_reviewed', 'skipped', 'confirmed', or 'failed'
+    #
     logging.debug("Attempting to reconcile {} snippet matches".format(len(hub_snippet_matches_by_file_path)))
+    if decisions is None:
+        decisions = {}
 
 
     snippets_reconciled = 0
@@ -157,6 +271,7 @@ def reconcile_snippet_matches(
         snippet_match_component = cur_snippet['fileSnippetBomComponents'][0]
         if snippet_match_component['reviewStatus'] != "NOT_REVIEWED":
             logging.info("Snippet match {} has already been reviewed. Skipping...".format(get_snippet_name_and_file_path(cur_snippet)))
+            decisions[source_file_path] = 'already_reviewed'
             continue
         else:
             logging.debug("Snippet match {} has not been reviewed, proceeding to reconcile".format(
@@ -164,7 +279,8 @@ def reconcile_snippet_matches(
 
         if not same_component(protex_bom_component, snippet_match_component):
             try:
-                alternate_match_component = hub.find_matching_alternative_snippet_match(target_project_id, target_version_id, cur_snippet, protex_bom_component)
+                with profiler.phase("find alternative match"):
+                    alternate_match_component = hub.find_matching_alternative_snippet_match(target_project_id, target_version_id, cur_snippet, protex_bom_component)
             except:
                 logging.error("Failed to find an alternative snippet match for Protex component {} due to an exception".format(
                     protex_bom_component_desc_str), exc_info=True)
@@ -172,9 +288,11 @@ def reconcile_snippet_matches(
             if alternate_match_component:
                 logging.debug("Found an alternate snippet match with the same OS component as the protex bom component")
                 try:
-                    result = hub.update_snippet_match(target_version_id, cur_snippet, alternate_match_component)
+                    with profiler.phase("update snippet match"):
+                        result = hub.update_snippet_match(target_version_id, cur_snippet, alternate_match_component)
                 except:
                     logging.error("Failed to update the snippet match selection with the alternate match component info due to an exception. Skipping...")
+                    decisions[source_file_path] = 'failed'
                     continue
                 else:
                     logging.debug("Updated snippet match with component info from alternate snippet match")
@@ -188,108 +306,33 @@ def reconcile_snippet_matches(
                 except:
                     logging.error("Failed to edit the current snippet match ({}) to use the Protex bom component {} due to an exception. Skipping this snippet match...".format(
                         cur_snippet['name'], protex_bom_component_desc_str), exc_info=True)
+                    decisions[source_file_path] = 'failed'
                     continue
             else:
                 logging.warn(
                     "We did not find a snippet match with a component equal to the Protex component {}, and override_snippet_component was False. Skipping the snippet match".format(protex_bom_component_desc_str))
+                decisions[source_file_path] = 'skipped'
                 continue
 
         try:
-            cur_status = hub.confirm_snippet_bom_entry(target_version_id, cur_snippet)
+            with profiler.phase("confirm snippet"):
+                cur_status = hub.confirm_snippet_bom_entry(target_version_id, cur_snippet)
         except:
             logging.error("Failed to confirm the snippet match due to an exception", exc_info=True)
             cur_status = 0
 
         if cur_status == 1:
+            decisions[source_file_path] = 'confirmed'
             logging.info("SUCCESS - confirmed snippet {} using Protex BOM component {}".format(
                 cur_snippet['name'], protex_bom_component_desc_str))
         else:
+            decisions[source_file_path] = 'failed'
             logging.warn("FAILED - did NOT confirm snippet {} using Protex BOM component {}".format(
                 cur_snippet['name'], protex_bom_component_desc_str))
         snippets_reconciled = snippets_reconciled + cur_status
 
     return snippets_reconciled 
 
-def get_paths_for_component_files_entry(component_files_entry):
-    # Returns the set of paths in the files entry for a component
-    # This is a flattened set, the set will contain duplicates if the Hub has multiple usages in the BOM for 
-    # the same path
-    paths = set()
-    for cur_item in component_files_entry['items']:
-        paths.add(cur_item['filePath']['path'])
-    return paths
-
-# def print_snippet_component_report(hub_snippet_matches_by_file_path):
-#     logging.debug("******************* Snippet -> Component potential matches ********************************")
-#     if not hub_snippet_matches_by_file_path:
-#         logging.debug("No Snippets or Components")
-#     for cur_path in hub_snippet_matches_by_file_path:
-#         protex_bom_component = hub_snippet_matches_by_file_path[cur_path][0]
-#         cur_snippet = hub_snippet_matches_by_file_path[cur_path][1]
-#         logging.debug(cur_path, ": ")
-#         logging.debug("--------------------Component: ")
-#         #logging.debug(json.dumps(protex_bom_component, indent=2))
-#         logging.debug("Component Name: ", protex_bom_component['componentName'])
-#         logging.debug("Component Version: ", protex_bom_component['componentVersionName'])
-#         logging.debug("Un-reconciled Snippets: Present")
-#         #logging.debug(json.dumps(cur_snippet, indent=2))
-#         logging.debug("***************************************************************************************")
-#     logging.debug()
-
-def process_bom_component(
-    project_id, 
-    target_version_id, 
-    protex_import_version_id, 
-    protex_bom_component, 
-    snippet_path_map, 
-    override_snippet_component=False,
-    use_best_match=False):
-    # Process a single component in a BOM and reconcile snippets that match a file already declared in the BOM
-    # Args:
-    #   Hub Project ID
-    #   Hub Version ID
-    #   Protex BOM export/import version id
-    #   Protex BOM Component to process
-    #   Dict of Paths -> Snippets
-    # Returns the total # of snippets that were reconciled/confirmed
-    protex_component_name, protex_version_name, protex_component_id, protex_bom_component_version_id = bom_component_info(protex_bom_component)
-
-    if protex_version_name:
-        protex_component_str = "{}:{}".format(protex_component_name, protex_version_name)
-    else:
-        protex_component_str = "{}".format(protex_component_name)
-    
-    logging.debug("Processing {}".format(protex_component_str))
-
-    protex_bom_component_files = hub.get_file_matches_for_component_with_version(
-        project_id, protex_import_version_id, protex_component_id, protex_bom_component_version_id)  
-    
-    if 'items' in protex_bom_component_files and len(protex_bom_component_files['items']) > 0:
-        logging.debug("Found {} paths associated with {}".format(len(protex_bom_component_files['items']), protex_component_str))
-
-        logging.debug("File paths associated with this Protex component: ")
-        for path in get_paths_for_component_files_entry(protex_bom_component_files):
-            logging.debug(path)
-        
-        component_by_file_map = get_component_file_map_by_path(protex_bom_component, protex_bom_component_files, snippet_path_map)
-
-        logging.debug("Found {} snippet matches whose source file path corresponds to source file paths in Protex component {}".format(
-            len(component_by_file_map), protex_component_str))
-
-        # print_snippet_component_report(component_by_file_map)
-
-        if len(component_by_file_map) > 0:
-            return reconcile_snippet_matches(
-                project_id, 
-                target_version_id, 
-                component_by_file_map, 
-                override_snippet_component=override_snippet_component,
-                use_best_match=use_best_match)
-    else:
-        logging.debug("Did not find any source file paths associated with {}".format(protex_component_str))
-    return 0
-
-
 # Main method
 def main():
     logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
@@ -322,20 +365,48 @@ def main():
     target_version_id = object_id(target_version)
     protex_import_version_id = object_id(protex_import_version)
 
-    ########
+    #######
     #
-    # Get Snippets from the target version and map them by their source path
+    # Index the source file paths in the Protex BOM components, then stream the snippets from the target version
+    # and keep only those whose source file path is in the index
     #
-    ########
-    snippet_data = hub.get_snippet_bom_entries(target_project_id, target_version_id)
-    # TODO: len(snippet_data['items']) showing 43 snippet matches when in the GUI it shows 44, hmmm...
-    snippet_path_map = get_snippet_path_map(snippet_data)
-            
+    #######
+    if args.state_dir:
+        state = SnippetReconciliationState(args.state_dir, target_project_id, target_version_id).load()
+    else:
+        state = None
+
+    with profiler.phase("index protex bom"):
+        protex_bom_components = get_protex_bom_components(protex_import_version, page_size=args.page_size)
+        if state:
+            fingerprint = SnippetReconciliationState.protex_bom_fingerprint(
+                protex_import_version_id, 
+                protex_bom_components, 
+                last_bom_update=protex_import_version.get('lastBomUpdateDate'),
+                matched_file_counts=get_protex_matched_file_counts(
+                    target_project_id, protex_import_version_id, protex_bom_components))
+        options = {
+            'override_snippet_component': args.override_snippet_component, 
+            'use_best_match': args.use_best_match}
+        if state and state.check_protex_bom(fingerprint, options) and state.state['protex_path_index']:
+            logging.debug("Protex BOM import is unchanged since the last run, re-using its path index")
+            protex_path_index = state.get_protex_path_index()
+        else:
+            protex_path_index = build_protex_path_index(
+                target_project_id, protex_import_version_id, protex_bom_components, page_size=args.page_size)
+            if state:
+                state.set_protex_path_index(protex_path_index)
+                state.save()
+    logging.debug("Indexed {} source file paths from the Protex BOM import".format(len(protex_path_index)))
+
     logging.debug("***********Project Snippets ***************************")
-    logging.debug("# Snippet Files: {}".format(snippet_data['totalCount']))
     logging.debug("Snippet file list:")
-    for snippet_name_and_file_path in get_snippet_names_and_file_paths(snippet_data):
-        logging.debug(snippet_name_and_file_path)
+    with profiler.phase("read snippet matches"):
+        hub_snippet_matches_by_file_path = get_snippet_matches_for_path_index(
+            target_project_id, target_version_id, protex_path_index, page_size=args.page_size, state=state)
+
+    logging.debug("Found {} snippet matches whose source file path corresponds to source file paths in the Protex BOM".format(
+        len(hub_snippet_matches_by_file_path)))
 
     #######
     #
@@ -343,19 +414,49 @@ def main():
     # files within the Protex BOM) 
     #
     #######
-    protex_components = hub.get_version_components(protex_import_version)
+    # Reconciled in batches so the decisions made so far are saved every STATE_SAVE_INTERVAL snippet matches
     total_snippets_confirmed = 0
-    
-    for protext_bom_component in protex_components['items']:
-        total_snippets_confirmed = total_snippets_confirmed + process_bom_component(
-            target_project_id, target_version_id, protex_import_version_id, protext_bom_component, snippet_path_map, \
-            override_snippet_component=args.override_snippet_component, use_best_match=args.use_best_match)
+    source_file_paths = list(hub_snippet_matches_by_file_path.keys())
+    for batch_start in range(0, len(source_file_paths), STATE_SAVE_INTERVAL):
+        batch = {
+            path: hub_snippet_matches_by_file_path[path] 
+            for path in source_file_paths[batch_start:batch_start + STATE_SAVE_INTERVAL]}
+        decisions = {}
+        with profiler.phase("reconcile snippet matches"):
+            total_snippets_confirmed = total_snippets_confirmed + reconcile_snippet_matches(
+                target_project_id, 
+                target_version_id, 
+                batch, 
+                override_snippet_component=args.override_snippet_component, 
+                use_best_match=args.use_best_match,
+                decisions=decisions)
+
+        if state:
+            for source_file_path, decision in decisions.items():
+                state.record(source_file_path, batch[source_file_path][1], decision)
+            state.save()
 
     logging.debug("Confirmed: {} snippets for project {}, version {}, using Protex BOM import {}".format(
         total_snippets_confirmed, args.project_name, args.version_name, args.protex_import_version))
     
 if __name__ == "__main__":
-    main()
+    args = parser.parse_args()
+
+    profiler = PhaseProfiler(args.profile)
+
+    hub = HubInstance()
+    transport = HubTransport(pool_size=args.connection_pool_size, timeout=args.timeout)
+    transport.install(hub)
+
+    profiler.start()
+    try:
+        main()
+    finally:
+        logging.info(transport.report())
+        transport.close()
+        profiler.stop()
+        if profiler.enabled:
+            logging.info("Profile:\n{}".format(profiler.report()))
 
         
 
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import logging
+import os
+
+
+class SnippetReconciliationState(object):
+	'''Local (JSON file) store of what was done when reconciling the snippet matches in a Hub project-version,
+	so a re-run only has to process the snippets that are new or changed since the last run.
+
+	It records
+		- a fingerprint of the Protex BOM import, and the index of source file paths -> Protex BOM component
+		  built from it, which is re-used as long as the fingerprint is unchanged
+		- the reconciliation options (e.g. use_best_match) the decisions were made with
+		- for each source file path, the decision made for its snippet match and a key identifying that match
+
+	Decisions are discarded whenever the Protex BOM fingerprint or the options change since they may no longer hold.
+	'''
+	# Decisions that hold on a re-run for as long as the snippet match, Protex BOM, and options are unchanged.
+	# Failures are always retried, and a snippet confirmed earlier that is un-reviewed again is re-processed
+	FINAL_DECISIONS = ['skipped']
+
+	def __init__(self, state_dir, project_id, version_id):
+		self.state_file = os.path.join(state_dir, "{}_{}.json".format(project_id, version_id))
+		self.state = {
+			'protex_bom_fingerprint': None,
+			'protex_bom_components': [],
+			'protex_path_index': {},
+			'options': None,
+			'decisions': {},
+		}
+
+	def load(self):
+		if os.path.exists(self.state_file):
+			with open(self.state_file) as f:
+				self.state = json.load(f)
+			logging.debug("Loaded snippet reconciliation state from {} ({} decisions)".format(
+				self.state_file, len(self.state['decisions'])))
+		return self
+
+	def save(self):
+		os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+		# write then rename so an interrupted run never leaves a partial state file behind
+		tmp_file = self.state_file + ".tmp"
+		with open(tmp_file, 'w') as f:
+			json.dump(self.state, f)
+		os.replace(tmp_file, self.state_file)
+
+	@staticmethod
+	def component_key(protex_bom_component):
+		return "{}|{}".format(protex_bom_component.get('component'), protex_bom_component.get('componentVersion'))
+
+	@staticmethod
+	def protex_bom_fingerprint(protex_import_version_id, protex_bom_components, last_bom_update=None, matched_file_counts=None):
+		'''Fingerprint of the Protex BOM import, made from its components and, since a re-import can keep the same
+		components but match different files, the time its BOM was last updated and the number of files matched to
+		each component (matched_file_counts maps component_key -> count)
+		'''
+		matched_file_counts = matched_file_counts or {}
+		components = sorted(
+			"{}|{}".format(SnippetReconciliationState.component_key(c), matched_file_counts.get(SnippetReconciliationState.component_key(c)))
+			for c in protex_bom_components)
+		return hashlib.sha256(
+			json.dumps([protex_import_version_id, last_bom_update, components]).encode('utf-8')).hexdigest()
+
+	@staticmethod
+	def snippet_key(snippet):
+		# Identifies a snippet match along with the component (and version) it is currently matched to
+		snippet_match_component = snippet['fileSnippetBomComponents'][0]
+		return "{}|{}|{}".format(
+			snippet['name'],
+			snippet_match_component.get('project', {}).get('id'),
+			snippet_match_component.get('release', {}).get('id'))
+
+	def check_protex_bom(self, fingerprint, options):
+		'''Discard the cached path index and decisions if the Protex BOM (fingerprint) or options changed.
+		Returns True if the state is still valid
+		'''
+		if self.state['protex_bom_fingerprint'] == fingerprint and self.state['options'] == options:
+			return True
+		if self.state['protex_bom_fingerprint'] is not None:
+			logging.info("Protex BOM import or options changed since the last run, discarding the previous reconciliation state")
+		self.state['protex_bom_fingerprint'] = fingerprint
+		self.state['protex_bom_components'] = []
+		self.state['protex_path_index'] = {}
+		self.state['options'] = options
+		self.state['decisions'] = {}
+		return False
+
+	def get_protex_path_index(self):
+		components = self.state['protex_bom_components']
+		return {path: components[i] for path, i in self.state['protex_path_index'].items()}
+
+	def set_protex_path_index(self, path_index):
+		# Store each component once, the index refers to components by their position
+		components = []
+		component_positions = {}
+		stored_index = {}
+		for path, component in path_index.items():
+			if id(component) not in component_positions:
+				component_positions[id(component)] = len(components)
+				components.append(component)
+			stored_index[path] = component_positions[id(component)]
+		self.state['protex_bom_components'] = components
+		self.state['protex_path_index'] = stored_index
+
+	def is_reconciled(self, path, snippet):
+		decision = self.state['decisions'].get(path)
+		return bool(decision) and decision['decision'] in SnippetReconciliationState.FINAL_DECISIONS and \
+			decision['snippet_key'] == SnippetReconciliationState.snippet_key(snippet)
+
+	def record(self, path, snippet, decision):
+		self.state['decisions'][path] = {
+			'decision': decision,
+			'snippet_key': SnippetReconciliationState.snippet_key(snippet),
+		}
@@ -0,0 +1,289 @@
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import pytest
+
+# Add Parent path to the PYTHONPATH
+import sys,inspect
+from datetime import datetime, timedelta
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from code_center_component_import import CodeCenterComponentImport
+from code_center_approval_sync import CodeCenterApprovalSync, PsqlQueryRunner
+
+class FakeCodeCenter(object):
+	# Stands in for the Code Center database, answers the queries CodeCenterApprovalSync makes
+	def __init__(self):
+		self.components = {}
+		self.component_uses = []
+		self.queries = []
+
+	def add_component(self, catalog_id, name, version, approval_status='APPROVED'):
+		self.components[str(catalog_id)] = {'name': name, 'version': version, 'approval_status': approval_status}
+
+	def add_component_use(self, catalog_id, approval_status, time_submitted, project_id=1):
+		component_use = {
+			'catalogid': str(catalog_id), 'projectid': str(project_id), 'approval_status': approval_status, 'time_submitted': time_submitted}
+		self.component_uses.append(component_use)
+		return component_use
+
+	def __call__(self, sql):
+		self.queries.append(sql)
+		if sql == CodeCenterApprovalSync.COMPONENT_USE_APPROVAL_STATUSES_SQL:
+			statuses = {}
+			for u in self.component_uses:
+				statuses.setdefault(u['catalogid'], []).append(u['approval_status'])
+			return [
+				{'catalogid': i, 'approval_statuses': hashlib.md5(",".join(sorted(s)).encode('utf-8')).hexdigest()}
+				for i, s in statuses.items()]
+		if sql.startswith(CodeCenterApprovalSync.SUBMITTED_SINCE_SQL.format("")):
+			since = re.search(r"time_submitted > timestamp '([^']*)' - interval '(\d+) seconds'", sql)
+			if since:
+				since = (datetime.strptime(since.group(1), CodeCenterApprovalSync.WATERMARK_FORMAT) -
+					timedelta(seconds=int(since.group(2)))).strftime(CodeCenterApprovalSync.WATERMARK_FORMAT)
+			return [
+				{'catalogid': u['catalogid'], 'projectid': u['projectid'], 'time_submitted': u['time_submitted']}
+				for u in self.component_uses if not since or u['time_submitted'] > since]
+		only = re.search(r"c.id in \(([^)]*)\)", sql)
+		return [
+			dict(approval_status=u['approval_status'], catalogid=u['catalogid'], component_name=self.components[u['catalogid']]['name'],
+				component_version=self.components[u['catalogid']]['version'], kb_component_id='kb' + u['catalogid'], kb_release_id='null')
+			for u in self.component_uses if not only or u['catalogid'] in only.group(1).split(",")]
+
+@pytest.fixture()
+def imported(monkeypatch):
+	# Records the component approvals that would have been imported into the Hub
+	imported = []
+	def _import_component(self, suite_component_info):
+		imported.append((suite_component_info['component_name'], suite_component_info['approval_status']))
+		return 'Failed' if suite_component_info['component_name'] == 'failing' else 'Updated'
+	monkeypatch.setattr(CodeCenterComponentImport, '_import_component', _import_component)
+	return imported
+
+def test_first_poll_syncs_everything_then_only_changes(tmp_path, imported):
+	code_center = FakeCodeCenter()
+	code_center.add_component(1, 'slf4j-nop', '2.0')
+	code_center.add_component(2, 'angularx-qrcode', '1.2.4')
+	code_center.add_component_use(1, 'APPROVED', '2019-01-10 13:50:14.955000')
+	code_center.add_component_use(2, 'PENDING', '2019-01-10 13:50:15.000000')
+	sync = CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json"))
+
+	assert sync.poll() == {'Updated': 2}
+	assert sorted(imported) == [('angularx-qrcode', 'PENDING'), ('slf4j-nop', 'APPROVED')]
+	assert sync.state['watermark'] == '2019-01-10 13:50:15.000000'
+
+	del imported[:]
+	assert sync.poll() == {}
+	assert imported == []
+
+	code_center.add_component_use(2, 'APPROVED', '2019-01-11 09:00:00.000000')
+	assert sync.poll() == {'Updated': 1}
+	assert imported == [('angularx-qrcode', 'APPROVED')]
+
+def test_component_use_approval_status_changes_are_synced(tmp_path, imported):
+	code_center = FakeCodeCenter()
+	code_center.add_component(1, 'slf4j-nop', '2.0')
+	code_center.add_component(2, 'angularx-qrcode', '1.2.4')
+	code_center.add_component_use(1, 'APPROVED', '2019-01-10 13:50:14.955000')
+	pending = code_center.add_component_use(2, 'PENDING', '2019-01-10 13:50:15.000000')
+	sync = CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json"), digest_interval=0)
+	sync.poll()
+	del imported[:]
+
+	# the pending request is approved, its time_submitted stays the same
+	pending['approval_status'] = 'APPROVED'
+
+	assert sync.poll() == {'Updated': 1}
+	assert imported == [('angularx-qrcode', 'APPROVED')]
+
+def test_approval_statuses_are_scanned_every_digest_interval(tmp_path, imported):
+	code_center = FakeCodeCenter()
+	code_center.add_component(2, 'angularx-qrcode', '1.2.4')
+	pending = code_center.add_component_use(2, 'PENDING', '2019-01-10 13:50:15.000000')
+	sync = CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json"), digest_interval=3600)
+	sync.poll()
+	del imported[:]
+
+	pending['approval_status'] = 'APPROVED'
+	assert sync.poll() == {}
+	assert code_center.queries.count(CodeCenterApprovalSync.COMPONENT_USE_APPROVAL_STATUSES_SQL) == 1
+
+	sync._digests_scanned_at = 0
+	assert sync.poll() == {'Updated': 1}
+	assert imported == [('angularx-qrcode', 'APPROVED')]
+
+def test_component_approval_status_alone_is_not_synced(tmp_path, imported):
+	# the import uses the componentuse approval statuses, a change to the component's own status has nothing to import
+	code_center = FakeCodeCenter()
+	code_center.add_component(1, 'slf4j-nop', '2.0')
+	code_center.add_component_use(1, 'APPROVED', '2019-01-10 13:50:14.955000')
+	sync = CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json"))
+	sync.poll()
+	del imported[:]
+
+	code_center.components['1']['approval_status'] = 'REJECTED'
+
+	assert sync.poll() == {}
+	assert imported == []
+
+def test_late_committed_component_uses_are_synced(tmp_path, imported):
+	code_center = FakeCodeCenter()
+	code_center.add_component(1, 'slf4j-nop', '2.0')
+	code_center.add_component(2, 'angularx-qrcode', '1.2.4')
+	code_center.add_component_use(1, 'APPROVED', '2019-01-10 13:50:14.955000')
+	sync = CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json"), watermark_overlap=60)
+	sync.poll()
+	del imported[:]
+
+	# committed after the last poll, but submitted before its watermark
+	code_center.add_component_use(2, 'REJECTED', '2019-01-10 13:50:10.000000')
+
+	assert sync.poll() == {'Updated': 1}
+	assert imported == [('angularx-qrcode', 'REJECTED')]
+	assert sync.state['watermark'] == '2019-01-10 13:50:14.955000'
+	assert sync.state['recently_submitted'] == [
+		'1|1|2019-01-10 13:50:14.955000', '2|1|2019-01-10 13:50:10.000000']
+
+	# rows already seen in the overlap are not synced again, and rows that fall out of it are forgotten
+	del imported[:]
+	code_center.add_component_use(1, 'APPROVED', '2019-01-10 13:52:00.000000')
+	assert sync.poll() == {'Updated': 1}
+	assert imported == [('slf4j-nop', 'APPROVED')]
+	assert sync.state['recently_submitted'] == ['1|1|2019-01-10 13:52:00.000000']
+
+def test_state_is_only_saved_when_it_changes(tmp_path, imported, monkeypatch):
+	code_center = FakeCodeCenter()
+	code_center.add_component(1, 'slf4j-nop', '2.0')
+	code_center.add_component_use(1, 'APPROVED', '2019-01-10 13:50:14.955000')
+	sync = CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json"))
+	saves = []
+	save = sync.save
+	monkeypatch.setattr(sync, 'save', lambda: saves.append(1) or save())
+
+	sync.poll()
+	sync.poll()
+	sync.poll()
+
+	assert saves == [1]
+
+def _add_failing_component(code_center):
+	code_center.add_component(1, 'slf4j-nop', '2.0')
+	code_center.add_component(2, 'failing', '1.0')
+	code_center.add_component_use(1, 'APPROVED', '2019-01-10 13:50:14.955000')
+	code_center.add_component_use(1, 'REJECTED', '2019-01-10 13:50:14.955000')
+	code_center.add_component_use(2, 'APPROVED', '2019-01-10 13:50:15.000000')
+
+def test_conflicts_and_failures(tmp_path, imported):
+	code_center = FakeCodeCenter()
+	_add_failing_component(code_center)
+	sync = CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json"), retry_delay=0)
+
+	assert sync.poll() == {'Conflict': 1, 'Failed': 1}
+	assert list(sync.state['failed_catalog_ids'].keys()) == ['2']
+	assert sync.state['failed_catalog_ids']['2']['attempts'] == 1
+
+	# failures are retried once their retry delay passed
+	del imported[:]
+	assert sync.poll() == {'Failed': 1}
+	assert imported == [('failing', 'APPROVED')]
+	assert sync.state['failed_catalog_ids']['2']['attempts'] == 2
+
+def test_failures_are_retried_with_backoff(tmp_path, imported):
+	code_center = FakeCodeCenter()
+	_add_failing_component(code_center)
+	sync = CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json"), retry_delay=3600)
+	sync.poll()
+	first_retry_at = sync.state['failed_catalog_ids']['2']['retry_at']
+	del imported[:]
+
+	assert sync.poll() == {}
+	assert imported == []
+
+	sync.state['failed_catalog_ids']['2']['retry_at'] = 0
+	assert sync.poll() == {'Failed': 1}
+	# the delay doubles after each failure
+	assert sync.state['failed_catalog_ids']['2']['retry_at'] - first_retry_at > 3600
+
+def test_failures_are_given_up_after_max_attempts(tmp_path, imported, caplog):
+	code_center = FakeCodeCenter()
+	_add_failing_component(code_center)
+	sync = CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json"), retry_delay=0, max_attempts=2)
+
+	sync.poll()
+	sync.poll()
+	del imported[:]
+
+	assert sync.poll() == {}
+	assert imported == []
+	assert sync.state['failed_catalog_ids'] == {}
+	assert caplog.text.count("Giving up on syncing Code Center component 2 after 2 attempts") == 1
+
+	# and it is synced again when it changes
+	code_center.add_component_use(2, 'APPROVED', '2019-01-10 13:55:00.000000')
+	assert sync.poll() == {'Failed': 1}
+
+def test_state_survives_restart(tmp_path, imported):
+	code_center = FakeCodeCenter()
+	code_center.add_component(1, 'slf4j-nop', '2.0')
+	code_center.add_component_use(1, 'APPROVED', '2019-01-10 13:50:14.955000')
+	CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json")).poll()
+	del imported[:]
+
+	restarted = CodeCenterApprovalSync(code_center, None, str(tmp_path / "state.json")).load()
+
+	assert restarted.state['watermark'] == '2019-01-10 13:50:14.955000'
+	assert restarted.poll() == {}
+	assert imported == []
+
+code_center_test_database = os.environ.get('CODE_CENTER_TEST_DATABASE')
+
+@pytest.mark.skipif(
+	not code_center_test_database or not shutil.which('psql'),
+	reason="Set CODE_CENTER_TEST_DATABASE to a local PostgreSQL database (which will be modified) to run")
+def test_sync_against_postgresql(tmp_path, imported):
+	def _psql(sql):
+		subprocess.run(['psql', '-q', '-v', 'ON_ERROR_STOP=1', '-d', code_center_test_database, '-c', sql], check=True)
+	_psql('''drop table if exists componentuse, component, application, enduser;
+create table component (id integer primary key, name text, version text, approval_status text, kb_component_id text, kb_release_id text);
+create table application (id integer primary key, name text, version text);
+create table enduser (id integer primary key, name text, first_name text, last_name text);
+create table componentuse (component integer, application integer, owner integer, approval_status text, kb_license_name text, time_submitted timestamp);
+insert into component values (1, 'slf4j-nop', '2.0', 'APPROVED', 'slf4jnop1459799', '2124956');
+insert into application values (1, 'WFC develop - WFAN', 'Unspecified');
+insert into enduser values (1, 'someone@synopsys.com', 'Someone', 'Synopsys');
+insert into componentuse values (1, 1, 1, 'APPROVED', 'Apache License 2.0', '2018-07-30 16:43:22.246');''')
+	sync = CodeCenterApprovalSync(
+		PsqlQueryRunner(database=code_center_test_database), None, str(tmp_path / "state.json"), digest_interval=0)
+
+	assert sync.poll() == {'Updated': 1}
+	assert sync.state['watermark'] == '2018-07-30 16:43:22.246000'
+	assert sync.poll() == {}
+
+	_psql("update componentuse set approval_status = 'REJECTED' where component = 1")
+	assert sync.poll() == {'Updated': 1}
+	assert imported == [('slf4j-nop', 'APPROVED'), ('slf4j-nop', 'REJECTED')]
+
+def test_psql_query_runner(tmp_path):
+	# Stands in for psql, writes a psql -A style result to the -o file
+	fake_psql = tmp_path / "psql"
+	fake_psql.write_text('''#!/bin/bash
+while [ $# -gt 0 ]; do
+	case "$1" in
+		-o) OUTPUT_FILE="$2"; shift ;;
+		-d) DATABASE="$2"; shift ;;
+	esac
+	shift
+done
+printf 'catalogid|approval_statuses\\n1|0cd8e8b1b4bc0b2c5ee6a7c1c1a3e0a4\\n' > "${OUTPUT_FILE}"
+''')
+	fake_psql.chmod(0o755)
+
+	run_query = PsqlQueryRunner(database='bds_catalog', host='cc-db', psql=str(fake_psql))
+
+	assert run_query(CodeCenterApprovalSync.COMPONENT_USE_APPROVAL_STATUSES_SQL) == [
+		{'catalogid': '1', 'approval_statuses': '0cd8e8b1b4bc0b2c5ee6a7c1c1a3e0a4'}]
+	assert run_query.connection_args == ['-d', 'bds_catalog', '-h', 'cc-db']
@@ -153,3 +153,162 @@ def test_reconciling_component_approvals_with_no_accepted_or_rejected(mock_hub_i
 		assert suite_component_info['component_version'] == '1.2.4'
 
 
+def test_update_approval_status_reuses_hub_lookups(mock_hub_instance, requests_mock):
+	# rows that share a component share its Hub lookups, the component is re-read after it is updated
+	hub_instance = mock_hub_instance()
+	casef = CodeCenterComponentImport("a_file_name", hub_instance)
+
+	component_url = "{}/api/components/a-component-id".format(fake_hub_host)
+	find_mock = requests_mock.get(
+		"{}/api/components?q=bdsuite:angularxqrcode3444828&limit=9999".format(fake_hub_host),
+		complete_qs=True,
+		json={'component': component_url})
+	component_mock = requests_mock.get(component_url, [
+		{'json': {'approvalStatus': 'UNREVIEWED'}},
+		{'json': {'approvalStatus': 'APPROVED'}},
+	])
+	update_mock = requests_mock.put(component_url)
+
+	assert casef._update_approval_status('angularxqrcode3444828', 'APPROVED', 'null') == 'Updated'
+	assert casef._update_approval_status('angularxqrcode3444828', 'APPROVED', 'null') == 'Equal'
+	assert casef._update_approval_status('angularxqrcode3444828', 'APPROVED', 'null') == 'Equal'
+
+	assert find_mock.call_count == 1
+	assert component_mock.call_count == 2
+	assert update_mock.call_count == 1
+	assert (casef.hub_lookups, casef.hub_lookups_reused) == (3, 3)
+
+def test_update_approval_status_with_a_stale_component(mock_hub_instance, requests_mock):
+	# the kept component changed in the Hub since it was read, the conditional update catches it
+	hub_instance = mock_hub_instance()
+	casef = CodeCenterComponentImport("a_file_name", hub_instance)
+
+	component_url = "{}/api/components/a-component-id".format(fake_hub_host)
+	requests_mock.get(
+		"{}/api/components?q=bdsuite:angularxqrcode3444828&limit=9999".format(fake_hub_host),
+		complete_qs=True,
+		json={'component': component_url})
+	component_mock = requests_mock.get(component_url, [
+		{'headers': {'ETag': '"an-etag"'}, 'json': {'approvalStatus': 'UNREVIEWED'}},
+		{'headers': {'ETag': '"a-new-etag"'}, 'json': {'approvalStatus': 'UNREVIEWED'}},
+	])
+	update_mock = requests_mock.put(component_url, [{'status_code': 412}, {'status_code': 200}])
+
+	assert casef._update_approval_status('angularxqrcode3444828', 'PENDING', 'null') == 'Equal'
+	assert casef._update_approval_status('angularxqrcode3444828', 'APPROVED', 'null') == 'Updated'
+
+	assert component_mock.call_count == 2
+	assert [r.headers['If-Match'] for r in update_mock.request_history] == ['"an-etag"', '"a-new-etag"']
+
+def test_update_approval_status_does_not_keep_failed_lookups(mock_hub_instance, requests_mock):
+	hub_instance = mock_hub_instance()
+	casef = CodeCenterComponentImport("a_file_name", hub_instance)
+
+	component_url = "{}/api/components/a-component-id".format(fake_hub_host)
+	find_mock = requests_mock.get(
+		"{}/api/components?q=bdsuite:angularxqrcode3444828&limit=9999".format(fake_hub_host),
+		complete_qs=True,
+		response_list=[
+			{'status_code': 401, 'json': {'errorCode': '{web.unauthorized}'}},
+			{'json': {'component': component_url}},
+		])
+	component_mock = requests_mock.get(component_url, [
+		{'status_code': 500, 'json': {'errorMessage': 'An unexpected error occurred'}},
+		{'json': {'approvalStatus': 'APPROVED'}},
+	])
+
+	assert casef._update_approval_status('angularxqrcode3444828', 'APPROVED', 'null') == 'Failed'
+	assert casef._update_approval_status('angularxqrcode3444828', 'APPROVED', 'null') == 'Failed'
+	assert casef._update_approval_status('angularxqrcode3444828', 'APPROVED', 'null') == 'Equal'
+
+	assert find_mock.call_count == 2
+	assert component_mock.call_count == 2
+
+def test_update_approval_status_sends_slim_conditional_update(mock_hub_instance, requests_mock):
+	hub_instance = mock_hub_instance()
+	casef = CodeCenterComponentImport("a_file_name", hub_instance)
+
+	version_url = "{}/api/components/a-component-id/versions/a-version-id".format(fake_hub_host)
+	requests_mock.get(
+		"{}/api/components?q=bdsuite:angularxqrcode3444828%2313663706&limit=9999".format(fake_hub_host),
+		complete_qs=True,
+		json={'component': "{}/api/components/a-component-id".format(fake_hub_host), 'version': version_url})
+	version_mock = requests_mock.get(
+		version_url,
+		headers={'ETag': '"an-etag"'},
+		json={'versionName': '1.2.4', 'approvalStatus': 'UNREVIEWED', '_meta': {'href': version_url, 'links': []}})
+	update_mock = requests_mock.put(version_url)
+
+	assert casef._update_approval_status('angularxqrcode3444828', 'REJECTED', '13663706') == 'Updated'
+
+	assert version_mock.call_count == 1
+	assert update_mock.last_request.json() == {'versionName': '1.2.4', 'approvalStatus': 'REJECTED'}
+	assert update_mock.last_request.headers['If-Match'] == '"an-etag"'
+	assert casef.updated_component_urls == [(version_url, 'REJECTED')]
+
+def test_update_approval_status_precondition_failed_is_retried(mock_hub_instance, requests_mock):
+	hub_instance = mock_hub_instance()
+	casef = CodeCenterComponentImport("a_file_name", hub_instance)
+
+	component_url = "{}/api/components/a-component-id".format(fake_hub_host)
+	requests_mock.get(
+		"{}/api/components?q=bdsuite:angularxqrcode3444828&limit=9999".format(fake_hub_host),
+		complete_qs=True,
+		json={'component': component_url})
+	component_mock = requests_mock.get(component_url, [
+		{'headers': {'ETag': '"an-etag"'}, 'json': {'approvalStatus': 'UNREVIEWED'}},
+		{'headers': {'ETag': '"a-new-etag"'}, 'json': {'approvalStatus': 'UNREVIEWED', 'description': 'changed'}},
+	])
+	update_mock = requests_mock.put(component_url, [{'status_code': 412}, {'status_code': 200}])
+
+	assert casef._update_approval_status('angularxqrcode3444828', 'APPROVED', 'null') == 'Updated'
+
+	assert component_mock.call_count == 2
+	assert update_mock.call_count == 2
+	assert update_mock.last_request.headers['If-Match'] == '"a-new-etag"'
+	assert update_mock.last_request.json() == {'approvalStatus': 'APPROVED', 'description': 'changed'}
+	assert casef.updated_component_urls == [(component_url, 'APPROVED')]
+
+def test_update_approval_status_precondition_failed_twice(mock_hub_instance, requests_mock):
+	hub_instance = mock_hub_instance()
+	casef = CodeCenterComponentImport("a_file_name", hub_instance)
+
+	component_url = "{}/api/components/a-component-id".format(fake_hub_host)
+	requests_mock.get(
+		"{}/api/components?q=bdsuite:angularxqrcode3444828&limit=9999".format(fake_hub_host),
+		complete_qs=True,
+		json={'component': component_url})
+	requests_mock.get(component_url, headers={'ETag': '"an-etag"'}, json={'approvalStatus': 'UNREVIEWED'})
+	update_mock = requests_mock.put(component_url, status_code=412)
+
+	assert casef._update_approval_status('angularxqrcode3444828', 'APPROVED', 'null') == 'Failed'
+
+	assert update_mock.call_count == 2
+	assert casef.updated_component_urls == []
+
+def test_verify_updates(mock_hub_instance, requests_mock):
+	hub_instance = mock_hub_instance()
+	casef = CodeCenterComponentImport("a_file_name", hub_instance, verify_sample_size=5)
+
+	approved_url = "{}/api/components/approved-id".format(fake_hub_host)
+	unreviewed_url = "{}/api/components/unreviewed-id".format(fake_hub_host)
+	requests_mock.get(approved_url, json={'approvalStatus': 'APPROVED'})
+	requests_mock.get(unreviewed_url, json={'approvalStatus': 'UNREVIEWED'})
+	casef.updated_component_urls = [(approved_url, 'APPROVED'), (unreviewed_url, 'APPROVED')]
+
+	assert casef.verify_updates() == [(unreviewed_url, 'APPROVED')]
+
+def test_verify_updates_with_hub_errors(mock_hub_instance, requests_mock, caplog):
+	hub_instance = mock_hub_instance()
+	casef = CodeCenterComponentImport("a_file_name", hub_instance, verify_sample_size=5)
+
+	approved_url = "{}/api/components/approved-id".format(fake_hub_host)
+	failing_url = "{}/api/components/failing-id".format(fake_hub_host)
+	requests_mock.get(approved_url, json={'approvalStatus': 'APPROVED'})
+	requests_mock.get(failing_url, status_code=503)
+	casef.updated_component_urls = [(approved_url, 'APPROVED'), (failing_url, 'APPROVED')]
+
+	with caplog.at_level('INFO'):
+		assert casef.verify_updates() == []
+
+	assert "Verified 1 updated suite components or component versions, 0 did not match, 1 could not be read" in caplog.text
@@ -0,0 +1,60 @@
+import csv
+import pytest
+
+# Add Parent path to the PYTHONPATH
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from code_center_component_import import CodeCenterComponentImport
+from code_center_export_reader import CodeCenterExportReader, InvalidExportFile
+
+def _dict_reader_rows(export_file):
+	with open(export_file, newline='') as csvfile:
+		return [r for r in csv.DictReader(csvfile, delimiter='|')]
+
+def _write_export(tmp_path, num_rows):
+	with open('test-get-protex-info.csv') as csvfile:
+		header, row = csvfile.read().splitlines()[:2]
+	export_file = tmp_path / "export.csv"
+	export_file.write_text("\n".join([header] + [row.replace('APPROVED', 'APPROVED{}'.format(i)) for i in range(num_rows)]) + "\n")
+	return str(export_file)
+
+def test_rows_match_dict_reader():
+	reader = CodeCenterExportReader(
+		'test-more-than-one-approval.csv', required_columns=CodeCenterComponentImport.REQUIRED_COL_NAMES, workers=1)
+
+	assert list(reader) == _dict_reader_rows('test-more-than-one-approval.csv')
+	assert reader.fieldnames[0] == 'approval_status'
+
+def test_parallel_chunks_keep_file_order(tmp_path):
+	export_file = _write_export(tmp_path, 500)
+	reader = CodeCenterExportReader(export_file, workers=2, chunk_size=1024)
+
+	rows = list(reader)
+
+	assert rows == _dict_reader_rows(export_file)
+	assert [r['approval_status'] for r in rows[:3]] == ['APPROVED0', 'APPROVED1', 'APPROVED2']
+
+def test_missing_required_columns(tmp_path):
+	export_file = tmp_path / "export.csv"
+	export_file.write_text("component_name|component_version\nangularx-qrcode|1.2.4\n")
+
+	with pytest.raises(InvalidExportFile):
+		list(CodeCenterExportReader(str(export_file), required_columns=CodeCenterComponentImport.REQUIRED_COL_NAMES))
+
+def test_empty_export(tmp_path):
+	export_file = tmp_path / "export.csv"
+	export_file.write_text("")
+
+	with pytest.raises(InvalidExportFile):
+		list(CodeCenterExportReader(str(export_file)))
+
+def test_malformed_rows_are_skipped(tmp_path):
+	export_file = tmp_path / "export.csv"
+	export_file.write_text("component_name|component_version\r\nangularx-qrcode|1.2.4\r\n(1 row)\r\n")
+	reader = CodeCenterExportReader(str(export_file), workers=1)
+
+	assert list(reader) == [{'component_name': 'angularx-qrcode', 'component_version': '1.2.4'}]
+	assert reader.malformed == 1
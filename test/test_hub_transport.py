@@ -0,0 +1,122 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+import requests
+
+# Add Parent path to the PYTHONPATH
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from hub_transport import HubTransport
+
+class FakeHubHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def _respond(self, body):
+		data = json.dumps(body).encode('utf-8')
+		if 'gzip' in self.headers.get('Accept-Encoding', ''):
+			data = gzip.compress(data)
+			self.send_response(200)
+			self.send_header('Content-Encoding', 'gzip')
+		else:
+			self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self):
+		self._respond({'path': self.path, 'authorization': self.headers.get('Authorization')})
+
+	def do_PUT(self):
+		body = self.rfile.read(int(self.headers['Content-Length']))
+		self._respond({'path': self.path, 'body': json.loads(body), 'if_match': self.headers.get('If-Match')})
+
+	def log_message(self, format, *args):
+		pass
+
+class FakeHubInstance(object):
+	# Stands in for a HubInstance, just the parts HubTransport uses
+	def __init__(self, baseurl):
+		self.config = {'insecure': False, 'baseurl': baseurl}
+
+	def get_headers(self):
+		return {'Authorization': 'Bearer aFakeToken'}
+
+@pytest.fixture()
+def fake_hub_url():
+	server = HTTPServer(('127.0.0.1', 0), FakeHubHandler)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	yield "http://127.0.0.1:{}".format(server.server_port)
+	server.shutdown()
+	server.server_close()
+
+@pytest.fixture()
+def hub_transport():
+	# install() patches requests.api.request for the whole process, so every transport is closed (which undoes it)
+	# even when the test fails
+	transports = []
+	def _create_transport(**kwargs):
+		transport = HubTransport(**kwargs)
+		transports.append(transport)
+		return transport
+	yield _create_transport
+	for transport in reversed(transports):
+		transport.close()
+
+def test_install_routes_hub_calls_through_the_session(fake_hub_url, hub_transport):
+	transport = hub_transport(pool_size=2)
+	hub_instance = transport.install(FakeHubInstance(fake_hub_url))
+
+	get_response = hub_instance.execute_get(fake_hub_url + "/api/components/1")
+	put_response = hub_instance.execute_put(
+		fake_hub_url + "/api/components/1", {'approvalStatus': 'APPROVED'}, custom_headers={'If-Match': 'an-etag'})
+
+	assert get_response.headers['Content-Encoding'] == 'gzip'
+	assert get_response.json() == {'path': '/api/components/1', 'authorization': 'Bearer aFakeToken'}
+	assert put_response.json() == {
+		'path': '/api/components/1', 'body': {'approvalStatus': 'APPROVED'}, 'if_match': 'an-etag'}
+
+def test_connections_are_reused(fake_hub_url, hub_transport):
+	transport = hub_transport(pool_size=2)
+	hub_instance = transport.install(FakeHubInstance(fake_hub_url))
+
+	for i in range(5):
+		hub_instance.execute_get(fake_hub_url + "/api/components/{}".format(i))
+
+	assert transport.connection_stats() == (1, 5)
+	assert "connection reuse ratio 0.80" in transport.report()
+
+def test_direct_requests_calls_to_the_hub_use_the_pool(fake_hub_url, hub_transport):
+	# e.g. HubInstance.get_project_versions calls requests.get rather than execute_get
+	module_request = requests.api.request
+	transport = hub_transport()
+	hub_instance = transport.install(FakeHubInstance(fake_hub_url))
+
+	hub_instance.execute_get(fake_hub_url + "/api/projects/1/versions")
+	response = requests.get(fake_hub_url + "/api/projects/1/versions", headers=hub_instance.get_headers())
+
+	assert response.json() == {'path': '/api/projects/1/versions', 'authorization': 'Bearer aFakeToken'}
+	assert transport.connection_stats() == (1, 2)
+	transport.close()
+	assert requests.api.request is module_request
+
+def test_other_hosts_are_not_routed_through_the_pool(fake_hub_url, hub_transport):
+	transport = hub_transport()
+	transport.install(FakeHubInstance("https://another-hub-host"))
+
+	requests.get(fake_hub_url + "/api/projects")
+
+	assert transport.connection_stats() == (0, 0)
+
+def test_report_without_requests(hub_transport):
+	transport = hub_transport()
+
+	assert transport.connection_stats() == (0, 0)
+	assert "Made 0 Hub requests" in transport.report()
@@ -0,0 +1,65 @@
+import requests
+import pytest
+
+# Add Parent path to the PYTHONPATH
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from phase_profiler import PhaseProfiler
+
+fake_url = "https://my-hub-host/api/components"
+
+def a_hot_function():
+	return sum(range(10000))
+
+def test_disabled_profiler_does_nothing(requests_mock):
+	requests_mock.get(fake_url)
+	profiler = PhaseProfiler()
+	original_request = requests.Session.request
+
+	profiler.start()
+	with profiler.phase("a phase"):
+		requests.get(fake_url)
+	profiler.stop()
+
+	assert profiler.phases == {}
+	assert requests.Session.request is original_request
+
+def test_phases_and_network_wait(requests_mock):
+	requests_mock.get(fake_url)
+	profiler = PhaseProfiler('phases')
+	original_request = requests.Session.request
+
+	profiler.start()
+	try:
+		with profiler.phase("outer"):
+			for i in range(2):
+				with profiler.phase("inner"):
+					requests.get(fake_url)
+			a_hot_function()
+	finally:
+		profiler.stop()
+
+	assert requests.Session.request is original_request
+	assert list(profiler.phases.keys()) == ["outer", "inner"]
+	outer_entries, outer_wall, outer_requests, outer_wait = profiler.phases["outer"]
+	inner_entries, inner_wall, inner_requests, inner_wait = profiler.phases["inner"]
+	assert (outer_entries, outer_requests) == (1, 2)
+	assert (inner_entries, inner_requests) == (2, 2)
+	assert outer_wall >= inner_wall >= inner_wait > 0
+	assert outer_wait == pytest.approx(inner_wait)
+	assert "outer" in profiler.report()
+
+def test_cprofile_report():
+	profiler = PhaseProfiler('cprofile')
+
+	profiler.start()
+	try:
+		with profiler.phase("a phase"):
+			a_hot_function()
+	finally:
+		profiler.stop()
+
+	assert "a_hot_function" in profiler.report()
@@ -0,0 +1,145 @@
+import stat
+import time
+import pytest
+
+# Add Parent path to the PYTHONPATH
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from protex_bom_export import ProtexBomExporter, ProtexBomExportFailed
+
+# Stands in for scan.protex.cli.sh, it prompts for the password (a-password) on its standard input. Projects named
+# fail-* always fail, projects named flaky-* fail on their first attempt and projects named hang-* never finish
+fake_export_script = '''#!/bin/bash
+while [ $# -gt 0 ]; do
+	case "$1" in
+		--project) PROJECT="$2"; shift ;;
+		--dryRunWriteDir) OUTPUT_DIR="$2"; shift ;;
+		--output) OUTPUT_FILE="$2"; shift ;;
+	esac
+	shift
+done
+echo "Password: "
+read -r PASSWORD
+if [ "${PASSWORD}" != "a-password" ]; then
+	echo "Invalid password"
+	exit 3
+fi
+case "${PROJECT}" in
+	fail-*) exit 1 ;;
+	no-output-*) exit 0 ;;
+	hang-*)
+		# like the real tool, a wrapper around another (long running) process
+		sleep 30 &
+		echo $! >> "${OUTPUT_DIR}/../hung_pids"
+		wait
+		exit 0 ;;
+	flaky-*)
+		if [ ! -f "${OUTPUT_DIR}/attempted" ]; then
+			touch "${OUTPUT_DIR}/attempted"
+			exit 2
+		fi ;;
+esac
+echo "{\\"project\\": \\"${PROJECT}\\"}" > "${OUTPUT_DIR}/${OUTPUT_FILE}"
+'''
+
+@pytest.fixture()
+def fake_exporter(tmp_path):
+	def _create_exporter(**kwargs):
+		export_script = tmp_path / "scan.protex.cli.sh"
+		export_script.write_text(fake_export_script)
+		export_script.chmod(export_script.stat().st_mode | stat.S_IEXEC)
+		kwargs.setdefault('retry_delay', 0)
+		kwargs.setdefault('protex_password', 'a-password')
+		return ProtexBomExporter(
+			"a-protex-host", "a_username", str(tmp_path / "exports"), export_script=str(export_script), **kwargs)
+	return _create_exporter
+
+def test_export_project(fake_exporter):
+	exporter = fake_exporter()
+
+	export_file = exporter.export_project("project 1")
+
+	assert os.path.basename(os.path.dirname(export_file)).startswith("project_1_")
+	with open(export_file) as f:
+		assert "project 1" in f.read()
+
+def test_project_output_dirs_do_not_collide(fake_exporter):
+	exporter = fake_exporter()
+
+	output_dirs = [exporter._project_output_dir(p) for p in ["a/b", "a_b", "project 1", "project_1"]]
+
+	assert len(set(output_dirs)) == 4
+	assert output_dirs[0] == exporter._project_output_dir("a/b")
+
+@pytest.mark.parametrize("protex_password", [None, "a-wrong-password"])
+def test_export_project_needs_the_password(fake_exporter, protex_password):
+	exporter = fake_exporter(retries=0, protex_password=protex_password)
+
+	with pytest.raises(ProtexBomExportFailed, match="exited with status 3"):
+		exporter.export_project("project 1")
+
+def test_export_project_retries(fake_exporter):
+	exporter = fake_exporter(retries=1)
+
+	export_file = exporter.export_project("flaky-project")
+
+	assert os.path.exists(export_file)
+
+def test_export_project_fails_after_retries(fake_exporter):
+	exporter = fake_exporter(retries=1)
+
+	with pytest.raises(ProtexBomExportFailed):
+		exporter.export_project("fail-project")
+
+def test_export_project_fails_without_output_file(fake_exporter):
+	exporter = fake_exporter(retries=0)
+
+	with pytest.raises(ProtexBomExportFailed):
+		exporter.export_project("no-output-project")
+
+def _is_running(pid):
+	# a killed process whose parent is gone may linger as a zombie until it is reaped, which is not running
+	try:
+		with open("/proc/{}/stat".format(pid)) as f:
+			return f.read().rsplit(")", 1)[1].split()[0] != 'Z'
+	except (IOError, OSError):
+		return False
+
+def test_export_project_times_out(fake_exporter, tmp_path):
+	exporter = fake_exporter(retries=1, export_timeout=0.5)
+
+	with pytest.raises(ProtexBomExportFailed, match="did not finish within 0.5 seconds"):
+		exporter.export_project("hang-project")
+
+	# every attempt's child processes were killed along with the wrapper
+	with open(str(tmp_path / "exports" / "hung_pids")) as f:
+		hung_pids = [int(pid) for pid in f.read().split()]
+	assert len(hung_pids) == 2
+	deadline = time.time() + 5
+	while any(_is_running(pid) for pid in hung_pids) and time.time() < deadline:
+		time.sleep(0.05)
+	assert not any(_is_running(pid) for pid in hung_pids)
+
+def test_export_projects(fake_exporter):
+	completed = []
+	exporter = fake_exporter(
+		max_workers=3, retries=0, on_export_complete=lambda project_name, export_file: completed.append(project_name))
+
+	exported, failed = exporter.export_projects(["project1", "project2", "fail-project", "project3"])
+
+	assert sorted(exported.keys()) == ["project1", "project2", "project3"]
+	assert failed == ["fail-project"]
+	assert sorted(completed) == ["project1", "project2", "project3"]
+
+def test_export_projects_downstream_failure(fake_exporter):
+	def _fail_downstream(project_name, export_file):
+		raise RuntimeError("downstream failed")
+	exporter = fake_exporter(on_export_complete=_fail_downstream)
+
+	exported, failed = exporter.export_projects(["project1"])
+
+	assert list(exported.keys()) == ["project1"]
+	assert failed == ["project1"]
@@ -0,0 +1,78 @@
+import pytest
+
+from blackduck.HubRestApi import HubInstance
+
+# Add Parent path to the PYTHONPATH
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+import reconcile_snippet_matches
+
+fake_hub_host = "https://my-hub-host"
+fake_bearer_token = "aFakeToken"
+
+@pytest.fixture()
+def mock_hub(requests_mock, monkeypatch):
+	requests_mock.post(
+		"{}/j_spring_security_check".format(fake_hub_host),
+		headers={"Set-Cookie": 'AUTHORIZATION_BEARER={}; Path=/; secure; Secure; HttpOnly'.format(fake_bearer_token)}
+	)
+	requests_mock.get("{}/api/current-version".format(fake_hub_host), json={"version": "2018.12.4"})
+	hub = HubInstance(fake_hub_host, "a_username", "a_password")
+	monkeypatch.setattr(reconcile_snippet_matches, 'hub', hub)
+	return hub
+
+def _page_query(request):
+	return (request.qs['limit'], request.qs['offset'])
+
+def test_iter_paged_items_pages_until_total_count(mock_hub, requests_mock):
+	files_url = "{}/api/projects/1/versions/2/components/3/matched-files".format(fake_hub_host)
+	paged_mock = requests_mock.get(files_url, [
+		{'json': {'totalCount': 5, 'items': [{'path': 'a'}, {'path': 'b'}]}},
+		{'json': {'totalCount': 5, 'items': [{'path': 'c'}, {'path': 'd'}]}},
+		{'json': {'totalCount': 5, 'items': [{'path': 'e'}]}},
+		{'json': {'totalCount': 5, 'items': [{'path': 'should not be read'}]}},
+	])
+
+	items = list(reconcile_snippet_matches.iter_paged_items(files_url, page_size=2))
+
+	assert [i['path'] for i in items] == ['a', 'b', 'c', 'd', 'e']
+	assert [_page_query(r) for r in paged_mock.request_history] == [
+		(['2'], ['0']), (['2'], ['2']), (['2'], ['4'])]
+
+def test_iter_paged_items_appends_to_an_existing_query(mock_hub, requests_mock):
+	snippets_url = reconcile_snippet_matches.get_snippet_bom_entries_url('1', '2')
+	paged_mock = requests_mock.get(snippets_url, json={'totalCount': 1, 'items': [{'name': 'a snippet'}]})
+
+	assert list(reconcile_snippet_matches.iter_paged_items(snippets_url, page_size=10)) == [{'name': 'a snippet'}]
+	assert paged_mock.last_request.qs['filter'] == ['bomreviewstatus:false', 'bominclusion:false']
+	assert _page_query(paged_mock.last_request) == (['10'], ['0'])
+
+def test_iter_paged_items_without_total_count_reads_one_page(mock_hub, requests_mock):
+	files_url = "{}/api/projects/1/versions/2/components/3/matched-files".format(fake_hub_host)
+	paged_mock = requests_mock.get(files_url, [
+		{'json': {'items': [{'path': 'a'}, {'path': 'b'}]}},
+		{'json': {'items': [{'path': 'should not be read'}]}},
+	])
+
+	assert [i['path'] for i in reconcile_snippet_matches.iter_paged_items(files_url, page_size=2)] == ['a', 'b']
+	assert paged_mock.call_count == 1
+
+def test_get_protex_matched_file_counts(mock_hub, requests_mock):
+	components = [
+		{'componentName': 'slf4j-nop', 'component': "{}/api/components/1".format(fake_hub_host),
+			'componentVersion': "{}/api/components/1/versions/2".format(fake_hub_host)},
+		{'componentName': 'angularx-qrcode', 'component': "{}/api/components/3".format(fake_hub_host)},
+	]
+	version_files_mock = requests_mock.get(
+		"{}/api/projects/p/versions/v/components/1/versions/2/matched-files".format(fake_hub_host), json={'totalCount': 7, 'items': [{}]})
+	requests_mock.get(
+		"{}/api/projects/p/versions/v/components/3/matched-files".format(fake_hub_host), json={'totalCount': 2, 'items': [{}]})
+
+	assert reconcile_snippet_matches.get_protex_matched_file_counts('p', 'v', components) == {
+		"{}/api/components/1|{}/api/components/1/versions/2".format(fake_hub_host, fake_hub_host): 7,
+		"{}/api/components/3|None".format(fake_hub_host): 2,
+	}
+	assert _page_query(version_files_mock.last_request) == (['1'], ['0'])
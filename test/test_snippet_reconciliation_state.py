@@ -0,0 +1,82 @@
+import pytest
+
+# Add Parent path to the PYTHONPATH
+import os,sys,inspect
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from snippet_reconciliation_state import SnippetReconciliationState
+
+protex_bom_components = [
+	{'componentName': 'slf4j-nop', 'component': 'https://my-hub-host/api/components/1', 'componentVersion': 'https://my-hub-host/api/components/1/versions/2'},
+	{'componentName': 'angularx-qrcode', 'component': 'https://my-hub-host/api/components/3'},
+]
+options = {'override_snippet_component': False, 'use_best_match': False}
+
+def _snippet(release_id='2'):
+	return {
+		'name': 'a snippet',
+		'compositePath': {'path': 'src/a.c'},
+		'fileSnippetBomComponents': [{'reviewStatus': 'NOT_REVIEWED', 'project': {'id': '1'}, 'release': {'id': release_id}}],
+	}
+
+def test_path_index_round_trip(tmp_path):
+	fingerprint = SnippetReconciliationState.protex_bom_fingerprint('protex-version-id', protex_bom_components)
+	state = SnippetReconciliationState(str(tmp_path), 'project-id', 'version-id')
+	assert not state.check_protex_bom(fingerprint, options)
+	state.set_protex_path_index({
+		'src/a.c': protex_bom_components[0], 'src/b.c': protex_bom_components[0], 'src/c.c': protex_bom_components[1]})
+	state.save()
+
+	reloaded = SnippetReconciliationState(str(tmp_path), 'project-id', 'version-id').load()
+
+	assert reloaded.check_protex_bom(fingerprint, options)
+	assert len(reloaded.state['protex_bom_components']) == 2
+	assert reloaded.get_protex_path_index() == {
+		'src/a.c': protex_bom_components[0], 'src/b.c': protex_bom_components[0], 'src/c.c': protex_bom_components[1]}
+
+def test_fingerprint_ignores_component_order():
+	assert SnippetReconciliationState.protex_bom_fingerprint('protex-version-id', protex_bom_components) == \
+		SnippetReconciliationState.protex_bom_fingerprint('protex-version-id', list(reversed(protex_bom_components)))
+	assert SnippetReconciliationState.protex_bom_fingerprint('protex-version-id', protex_bom_components) != \
+		SnippetReconciliationState.protex_bom_fingerprint('protex-version-id', protex_bom_components[:1])
+
+def test_fingerprint_changes_on_re_import():
+	matched_file_counts = {SnippetReconciliationState.component_key(c): 10 for c in protex_bom_components}
+	fingerprint = SnippetReconciliationState.protex_bom_fingerprint(
+		'protex-version-id', protex_bom_components, '2019-01-08T10:00:00.000Z', matched_file_counts)
+
+	# same components, but the BOM was updated or matches a different number of files
+	assert fingerprint != SnippetReconciliationState.protex_bom_fingerprint(
+		'protex-version-id', protex_bom_components, '2019-01-09T10:00:00.000Z', matched_file_counts)
+	matched_file_counts[SnippetReconciliationState.component_key(protex_bom_components[1])] = 11
+	assert fingerprint != SnippetReconciliationState.protex_bom_fingerprint(
+		'protex-version-id', protex_bom_components, '2019-01-08T10:00:00.000Z', matched_file_counts)
+
+def test_only_unchanged_final_decisions_are_reconciled(tmp_path):
+	state = SnippetReconciliationState(str(tmp_path), 'project-id', 'version-id')
+	state.check_protex_bom('a-fingerprint', options)
+
+	state.record('src/a.c', _snippet(), 'skipped')
+	state.record('src/b.c', _snippet(), 'failed')
+
+	assert state.is_reconciled('src/a.c', _snippet())
+	assert not state.is_reconciled('src/a.c', _snippet(release_id='3'))
+	assert not state.is_reconciled('src/b.c', _snippet())
+	assert not state.is_reconciled('src/c.c', _snippet())
+
+@pytest.mark.parametrize("fingerprint,new_options", [
+	('another-fingerprint', options),
+	('a-fingerprint', {'override_snippet_component': True, 'use_best_match': False}),
+])
+def test_changes_discard_state(tmp_path, fingerprint, new_options):
+	state = SnippetReconciliationState(str(tmp_path), 'project-id', 'version-id')
+	state.check_protex_bom('a-fingerprint', options)
+	state.set_protex_path_index({'src/a.c': protex_bom_components[0]})
+	state.record('src/a.c', _snippet(), 'skipped')
+
+	assert not state.check_protex_bom(fingerprint, new_options)
+
+	assert state.get_protex_path_index() == {}
+	assert not state.is_reconciled('src/a.c', _snippet())